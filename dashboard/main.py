@@ -1,47 +1,131 @@
 # dashboard/main.py
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
-from fastapi.responses import HTMLResponse
+from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import HTMLResponse, ORJSONResponse, Response
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 import asyncio
+import hashlib
 import json
+import orjson
 import uuid
+from contextlib import asynccontextmanager
 from typing import Dict, List
-from shared.redis_client import redis_client
+from shared.redis_client import redis_client, pubsub_client, PUBSUB_POLL_TIMEOUT
 from shared.schemas import Alert, Feedback
 import datetime
 
-app = FastAPI(title="SentinelFlow Dashboard")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Run the alert listener and batched alert writer for the app's lifetime"""
+    # Held on app.state so the tasks are not garbage collected
+    app.state.background_tasks = [
+        asyncio.create_task(alert_store.run()),
+        asyncio.create_task(listen_for_alerts())
+    ]
+    for task in app.state.background_tasks:
+        task.add_done_callback(_on_background_task_done)
+    try:
+        yield
+    finally:
+        for task in app.state.background_tasks:
+            task.cancel()
+        await asyncio.gather(*app.state.background_tasks, return_exceptions=True)
+
+
+def _on_background_task_done(task: asyncio.Task):
+    if not task.cancelled() and task.exception() is not None:
+        print(f"❌ Dashboard background task failed: {task.exception()}")
+
+
+app = FastAPI(
+    title="SentinelFlow Dashboard",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan
+)
 
 # Mount static files and templates (if they exist)
 # app.mount("/static", StaticFiles(directory="static"), name="static")
 # templates = Jinja2Templates(directory="templates")
 
 class ConnectionManager:
-    def __init__(self):
+    def __init__(self, max_queue_size: int = 64, max_batch_size: int = 64,
+                 max_frame_rate: float = 20.0):
         self.active_connections: List[WebSocket] = []
+        # Per-connection outbound queue, drained by one flusher task each
+        self.queues: Dict[WebSocket, asyncio.Queue] = {}
+        self.flushers: Dict[WebSocket, asyncio.Task] = {}
+        # Per-connection minimum final_score for alerts it wants to receive
+        self.min_risk: Dict[WebSocket, float] = {}
+        self.max_queue_size = max_queue_size
+        self.max_batch_size = max_batch_size
+        self.min_frame_interval = 1.0 / max_frame_rate
     
-    async def connect(self, websocket: WebSocket):
+    async def connect(self, websocket: WebSocket, min_risk: float = 0.0):
         await websocket.accept()
         self.active_connections.append(websocket)
+        self.queues[websocket] = asyncio.Queue(maxsize=self.max_queue_size)
+        self.min_risk[websocket] = min_risk
+        self.flushers[websocket] = asyncio.create_task(self._flusher(websocket))
     
     def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
+        if websocket in self.active_connections:
+            self.active_connections.remove(websocket)
+        self.queues.pop(websocket, None)
+        self.min_risk.pop(websocket, None)
+        flusher = self.flushers.pop(websocket, None)
+        if flusher is not None and flusher is not asyncio.current_task():
+            flusher.cancel()
+    
+    def set_min_risk(self, websocket: WebSocket, min_risk: float):
+        """Only send this connection alerts with final_score >= min_risk"""
+        if websocket in self.min_risk:
+            self.min_risk[websocket] = min_risk
     
     async def send_personal_message(self, message: str, websocket: WebSocket):
         await websocket.send_text(message)
     
     async def broadcast(self, message: str):
-        disconnected = []
-        for connection in self.active_connections:
-            try:
-                await connection.send_text(message)
-            except:
-                disconnected.append(connection)
+        """Queue a JSON-encoded message for every connection"""
+        self._enqueue(self.queues.values(), message)
+    
+    async def broadcast_alert(self, alert_data: dict):
+        """Queue an alert for connections subscribed to its risk level"""
+        if not self.active_connections:
+            return  # Nobody listening: skip encoding entirely
         
-        # Clean up disconnected clients
-        for conn in disconnected:
-            self.active_connections.remove(conn)
+        score = alert_data['ensemble_decision']['final_score']
+        queues = [
+            queue for websocket, queue in self.queues.items()
+            if score >= self.min_risk[websocket]
+        ]
+        if queues:
+            self._enqueue(queues, orjson.dumps(alert_data).decode())
+    
+    def _enqueue(self, queues, message: str):
+        for queue in queues:
+            if queue.full():
+                # Slow client: drop its oldest message rather than block
+                queue.get_nowait()
+            queue.put_nowait(message)
+    
+    async def _flusher(self, websocket: WebSocket):
+        """Send queued messages to one client as JSON array frames,
+        at most max_frame_rate frames per second"""
+        queue = self.queues[websocket]
+        try:
+            while True:
+                messages = [await queue.get()]
+                while not queue.empty() and len(messages) < self.max_batch_size:
+                    messages.append(queue.get_nowait())
+                await websocket.send_text('[' + ','.join(messages) + ']')
+                # Let messages coalesce (oldest dropped on overflow) until the next frame
+                await asyncio.sleep(self.min_frame_interval)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # Clean up disconnected client
+            self.disconnect(websocket)
 
 
 class KillSwitch:
@@ -49,18 +133,21 @@ class KillSwitch:
     def __init__(self):
         self.is_active = False
         self.activation_time = None
+        # ISO string computed once per activation and reused by get_status
+        self.activation_time_iso = None
         self.activated_by = None
     
     async def activate(self, analyst_id: str = "unknown"):
         """Activate kill switch and broadcast to all services"""
         self.is_active = True
-        self.activation_time = datetime.datetime.now()
+        self.activation_time = datetime.datetime.now(datetime.timezone.utc)
+        self.activation_time_iso = self.activation_time.isoformat()
         self.activated_by = analyst_id
         
         # Broadcast to detection engine and other services
-        await redis_client.publish('kill_switch', json.dumps({
+        await redis_client.publish('kill_switch', orjson.dumps({
             'active': True,
-            'timestamp': self.activation_time.isoformat(),
+            'timestamp': self.activation_time_iso,
             'activated_by': analyst_id
         }))
         
@@ -72,9 +159,9 @@ class KillSwitch:
         self.is_active = False
         
         # Broadcast deactivation
-        await redis_client.publish('kill_switch', json.dumps({
+        await redis_client.publish('kill_switch', orjson.dumps({
             'active': False,
-            'timestamp': datetime.datetime.now().isoformat(),
+            'timestamp': datetime.datetime.now(datetime.timezone.utc),
             'deactivated_by': analyst_id
         }))
         
@@ -85,38 +172,102 @@ class KillSwitch:
         """Get current kill switch status"""
         return {
             'active': self.is_active,
-            'activation_time': self.activation_time.isoformat() if self.activation_time else None,
+            'activation_time': self.activation_time_iso,
             'activated_by': self.activated_by
         }
 
 
+class AlertStore:
+    """Buffers alerts and persists them to Redis in pipelined batches"""
+    def __init__(self, max_batch_size: int = 256, max_delay: float = 0.005):
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+    
+    def add(self, alert: Alert):
+        """Queue an alert for the next batched write"""
+        self.queue.put_nowait(alert)
+    
+    async def run(self):
+        """Drain up to max_batch_size alerts or max_delay seconds per write"""
+        loop = asyncio.get_running_loop()
+        while True:
+            alerts = [await self.queue.get()]
+            deadline = loop.time() + self.max_delay
+            
+            while len(alerts) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    alerts.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            
+            try:
+                await store_alerts_bulk(alerts)
+            except Exception as e:
+                print(f"❌ Error storing {len(alerts)} alerts: {e}")
+
+
 manager = ConnectionManager()
 kill_switch = KillSwitch()
+alert_store = AlertStore()
 
 # **FIX 1: Use Redis for persistence instead of memory**
 # alerts_db: Dict[str, Alert] = {}  # OLD: Memory-only storage
 
 
+async def listen_for_alerts():
+    """Store explained alerts and push them to connected dashboards"""
+    pubsub = pubsub_client.pubsub(ignore_subscribe_messages=True)
+    await pubsub.subscribe('alerts_with_explanations')
+    
+    print("👂 Listening for explained alerts...")
+    
+    while True:
+        message = await pubsub.get_message(timeout=PUBSUB_POLL_TIMEOUT)
+        if message is None:
+            continue
+        try:
+            alert_data = orjson.loads(message['data'])
+            # Feedback looks alerts up by transaction id
+            alert_data['alert_id'] = alert_data['transaction']['transaction_id']
+            alert_data['created_at'] = datetime.datetime.now(datetime.timezone.utc)
+            
+            alert_store.add(Alert.model_validate(alert_data))
+            await manager.broadcast_alert(alert_data)
+        except Exception as e:
+            print(f"❌ Error handling alert: {e}")
+
+
 async def store_alert(alert: Alert):
     """Store alert in Redis"""
-    await redis_client.setex(
-        f"alert:{alert.alert_id}",
-        86400,  # 24 hour TTL
-        json.dumps(alert.dict(), default=str)
-    )
+    await store_alerts_bulk([alert])
+
+
+async def store_alerts_bulk(alerts: List[Alert]):
+    """Store many alerts in Redis in a single pipelined round trip"""
+    async with redis_client.pipeline(transaction=False) as pipe:
+        for alert in alerts:
+            pipe.setex(
+                f"alert:{alert.alert_id}",
+                86400,  # 24 hour TTL
+                orjson.dumps(alert.model_dump())
+            )
+        await pipe.execute()
 
 
 async def get_alert(alert_id: str) -> Alert:
     """Retrieve alert from Redis"""
     data = await redis_client.get(f"alert:{alert_id}")
     if data:
-        return Alert(**json.loads(data))
+        return Alert.model_validate_json(data)
     return None
 
 
-@app.get("/")
-async def get():
-    return HTMLResponse("""
+# Dashboard page, encoded once at import instead of on every request
+_INDEX_HTML_BYTES = """
     <!DOCTYPE html>
     <html>
         <head>
@@ -333,9 +484,17 @@ async def get():
                     }, 3000);
                 };
                 
+                // Alerts waiting for the next animation frame
+                let pendingAlerts = [];
+                let flushScheduled = false;
+                
                 ws.onmessage = function(event) {
-                    const alert = JSON.parse(event.data);
-                    displayAlert(alert);
+                    // Alerts arrive batched as a JSON array per frame
+                    pendingAlerts.push(...JSON.parse(event.data));
+                    if (!flushScheduled) {
+                        flushScheduled = true;
+                        requestAnimationFrame(flushAlerts);
+                    }
                 };
                 
                 function updateConnectionStatus(connected) {
@@ -349,8 +508,34 @@ async def get():
                     }
                 }
                 
-                function displayAlert(alert) {
+                function flushAlerts() {
+                    flushScheduled = false;
                     const alertsDiv = document.getElementById("alerts");
+                    
+                    // Only the newest 10 can stay visible, so skip building the rest
+                    const fragment = document.createDocumentFragment();
+                    for (const alert of pendingAlerts.slice(-10)) {
+                        fragment.prepend(buildAlertCard(alert));
+                    }
+                    pendingAlerts = [];
+                    
+                    // Prepend new alerts to top in a single DOM update
+                    alertsDiv.prepend(fragment);
+                    
+                    // Keep only last 10 alerts visible
+                    while (alertsDiv.children.length > 10) {
+                        alertsDiv.lastElementChild.remove();
+                    }
+                }
+                
+                function createElement(tag, className, text) {
+                    const el = document.createElement(tag);
+                    if (className) el.className = className;
+                    if (text !== undefined) el.textContent = text;
+                    return el;
+                }
+                
+                function buildAlertCard(alert) {
                     const score = alert.ensemble_decision.final_score;
                     
                     let riskClass = 'low-risk';
@@ -367,64 +552,52 @@ async def get():
                         riskText = 'MEDIUM RISK';
                     }
                     
-                    const alertHtml = `
-                        <div class="alert-card ${riskClass}" id="alert-${alert.alert_id}">
-                            <div class="alert-header">
-                                <h3>Alert: ${alert.alert_id}</h3>
-                                <span class="risk-badge ${riskBadge}">${riskText}</span>
-                            </div>
-                            
-                            <div class="transaction-details">
-                                <div class="detail-item">
-                                    <div class="detail-label">Transaction ID:</div>
-                                    <div>${alert.transaction.transaction_id}</div>
-                                </div>
-                                <div class="detail-item">
-                                    <div class="detail-label">Amount:</div>
-                                    <div>${alert.transaction.amount.toFixed(2)}</div>
-                                </div>
-                                <div class="detail-item">
-                                    <div class="detail-label">Customer:</div>
-                                    <div>${alert.transaction.customer_id}</div>
-                                </div>
-                                <div class="detail-item">
-                                    <div class="detail-label">Merchant:</div>
-                                    <div>${alert.transaction.merchant_id}</div>
-                                </div>
-                                <div class="detail-item">
-                                    <div class="detail-label">Risk Score:</div>
-                                    <div><strong>${score.toFixed(3)}</strong></div>
-                                </div>
-                                <div class="detail-item">
-                                    <div class="detail-label">Timestamp:</div>
-                                    <div>${new Date(alert.transaction.timestamp).toLocaleString()}</div>
-                                </div>
-                            </div>
-                            
-                            <div class="explanation">
-                                <strong>🔍 Analysis:</strong><br>
-                                ${alert.explanation || 'No explanation available'}
-                            </div>
-                            
-                            <div class="actions">
-                                <button class="btn btn-approve" onclick="submitFeedback('${alert.alert_id}', true)">
-                                    ✓ Approve (Legitimate)
-                                </button>
-                                <button class="btn btn-reject" onclick="submitFeedback('${alert.alert_id}', false)">
-                                    ✗ Reject (Fraud)
-                                </button>
-                            </div>
-                        </div>
-                    `;
+                    const card = createElement('div', `alert-card ${riskClass}`);
+                    card.id = `alert-${alert.alert_id}`;
                     
-                    // Prepend new alerts to top
-                    alertsDiv.insertAdjacentHTML('afterbegin', alertHtml);
+                    const header = createElement('div', 'alert-header');
+                    header.append(
+                        createElement('h3', null, `Alert: ${alert.alert_id}`),
+                        createElement('span', `risk-badge ${riskBadge}`, riskText)
+                    );
                     
-                    // Keep only last 10 alerts visible
-                    const alerts = alertsDiv.children;
-                    while (alerts.length > 10) {
-                        alertsDiv.removeChild(alerts[alerts.length - 1]);
+                    const details = createElement('div', 'transaction-details');
+                    const detailItems = [
+                        ['Transaction ID:', alert.transaction.transaction_id],
+                        ['Amount:', alert.transaction.amount.toFixed(2)],
+                        ['Customer:', alert.transaction.customer_id],
+                        ['Merchant:', alert.transaction.merchant_id],
+                        ['Risk Score:', score.toFixed(3)],
+                        ['Timestamp:', new Date(alert.transaction.timestamp).toLocaleString()]
+                    ];
+                    for (const [label, value] of detailItems) {
+                        const item = createElement('div', 'detail-item');
+                        const valueEl = createElement('div');
+                        if (label === 'Risk Score:') {
+                            valueEl.append(createElement('strong', null, value));
+                        } else {
+                            valueEl.textContent = value;
+                        }
+                        item.append(createElement('div', 'detail-label', label), valueEl);
+                        details.append(item);
                     }
+                    
+                    const explanation = createElement('div', 'explanation');
+                    explanation.append(
+                        createElement('strong', null, '🔍 Analysis:'),
+                        document.createElement('br'),
+                        alert.explanation || 'No explanation available'
+                    );
+                    
+                    const actions = createElement('div', 'actions');
+                    const approveBtn = createElement('button', 'btn btn-approve', '✓ Approve (Legitimate)');
+                    approveBtn.onclick = () => submitFeedback(alert.alert_id, true);
+                    const rejectBtn = createElement('button', 'btn btn-reject', '✗ Reject (Fraud)');
+                    rejectBtn.onclick = () => submitFeedback(alert.alert_id, false);
+                    actions.append(approveBtn, rejectBtn);
+                    
+                    card.append(header, details, explanation, actions);
+                    return card;
                 }
                 
                 async function submitFeedback(alertId, isLegitimate) {
@@ -499,4 +672,44 @@ async def get():
             </script>
         </body>
     </html>
-    """)
\ No newline at end of file
+    """.encode()
+
+_INDEX_HEADERS = {
+    'Cache-Control': 'public, max-age=3600',
+    'ETag': f'"{hashlib.blake2b(_INDEX_HTML_BYTES).hexdigest()[:16]}"'
+}
+
+
+@app.websocket("/ws")
+async def websocket_endpoint(websocket: WebSocket):
+    """Stream alerts to a dashboard; it may send {"min_risk": x} to filter them"""
+    await manager.connect(websocket)
+    try:
+        while True:
+            text = await websocket.receive_text()
+            try:
+                min_risk = float(orjson.loads(text)['min_risk'])
+            except (ValueError, TypeError, KeyError):
+                continue  # Not a filter update
+            manager.set_min_risk(websocket, min_risk)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        manager.disconnect(websocket)
+
+
+@app.get("/")
+async def get(request: Request):
+    if request.headers.get('if-none-match') == _INDEX_HEADERS['ETag']:
+        return Response(status_code=304, headers=_INDEX_HEADERS)
+    return Response(content=_INDEX_HTML_BYTES, media_type="text/html", headers=_INDEX_HEADERS)
+
+
+if __name__ == "__main__":
+    import uvicorn
+    try:
+        import uvloop  # POSIX only; otherwise keep the default asyncio loop
+        uvloop.install()
+    except ImportError:
+        pass
+    uvicorn.run(app, host="0.0.0.0", port=8002)
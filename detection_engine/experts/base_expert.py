@@ -1,17 +1,43 @@
 # detection_engine/experts/base_expert.py
 from abc import ABC, abstractmethod
 from shared.schemas import Transaction, ExpertDecision
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
+import numpy as np
+from ..feature_extractor import FeatureExtractor
 
 class BaseExpert(ABC):
     def __init__(self, name: str, model_type: str):
         self.name = name
         self.model_type = model_type
+        self._feature_extractor = None
     
+    # Experts are trusted internal constructors: build decisions with
+    # ExpertDecision.model_construct (plain Python floats only) to skip
+    # validation on the hot path
     @abstractmethod
     def predict(self, transaction: Transaction) -> ExpertDecision:
         pass
     
+    def predict_batch(self, transactions: List[Transaction],
+                      features: Optional[np.ndarray] = None) -> List[ExpertDecision]:
+        """
+        Score a micro-batch of transactions
+        
+        features is the shared (B, D) matrix from FeatureExtractor, if the
+        caller has already built it.
+        """
+        # Override in subclasses that can score a feature matrix at once
+        return [self.predict(transaction) for transaction in transactions]
+    
+    def _features(self, transactions: List[Transaction],
+                  features: Optional[np.ndarray]) -> np.ndarray:
+        """Use the caller's feature matrix, or extract one when called standalone"""
+        if features is not None:
+            return features
+        if self._feature_extractor is None:
+            self._feature_extractor = FeatureExtractor()
+        return self._feature_extractor.extract_batch(transactions)
+    
     def calculate_confidence(self, transaction: Transaction) -> float:
         """Default confidence calculation"""
         return 0.8  # Override in subclasses
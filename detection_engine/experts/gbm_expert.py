@@ -2,6 +2,7 @@
 import xgboost as xgb
 import numpy as np
 from .base_expert import BaseExpert
+from ..feature_extractor import AMOUNT
 from shared.schemas import ExpertDecision
 
 class XGBoostExpert(BaseExpert):
@@ -15,44 +16,38 @@ class XGBoostExpert(BaseExpert):
         # For prototype, return a dummy model
         return None
     
-    def predict(self, transaction):
-        # Feature vector from transaction
-        features = self._extract_features(transaction)
-        
-        # Mock prediction (replace with actual model)
-        score = self._mock_predict(features)
+    def predict(self, transaction, features=None):
+        if features is not None:
+            features = features[np.newaxis]
+        return self.predict_batch([transaction], features)[0]
+    
+    def predict_batch(self, transactions, features=None):
+        # Shared feature matrix for the whole micro-batch
+        features = self._features(transactions, features)
         
-        # Mock SHAP explanations
-        factors = self._generate_factors(transaction, features)
+        if self.model is not None:
+            # inplace_predict skips building a DMatrix for every batch
+            scores = self.model.inplace_predict(features)
+        else:
+            # Mock prediction (replace with actual model)
+            scores = self._mock_predict(features)
         
-        return ExpertDecision(
-            expert_name=self.name,
-            score=score,
-            confidence=self.calculate_confidence(transaction),
-            contributing_factors=factors,
-            model_type=self.model_type
-        )
-    
-    def _extract_features(self, transaction):
-        # Convert transaction to feature vector
-        feature_values = list(transaction.features.values())
-        # Add engineered features
-        feature_values.extend([
-            transaction.amount / 1000,
-            len(transaction.customer_id) / 100
-        ])
-        return np.array([feature_values])
+        return [
+            ExpertDecision.model_construct(
+                expert_name=self.name,
+                score=float(score),
+                confidence=self.calculate_confidence(transaction),
+                # Mock SHAP explanations
+                contributing_factors=self._generate_factors(transaction, features[i]),
+                model_type=self.model_type
+            )
+            for i, (transaction, score) in enumerate(zip(transactions, scores))
+        ]
     
     def _mock_predict(self, features):
-        # Simple rule-based mock (replace with actual model)
-        amount = features[0][-2] * 1000  # Denormalize amount
-        
-        if amount > 1000:
-            return 0.8
-        elif amount > 500:
-            return 0.4
-        else:
-            return 0.1
+        # Simple rule-based mock over a (B, D) matrix (replace with actual model)
+        amount = features[:, AMOUNT] * 1000  # Denormalize amount
+        return np.select([amount > 1000, amount > 500], [0.8, 0.4], default=0.1)
     
     def _generate_factors(self, transaction, features):
         # Mock SHAP-like factors
@@ -2,87 +2,208 @@
 import numpy as np
 from .base_expert import BaseExpert
 from shared.schemas import ExpertDecision
-from collections import deque
-import random
+
+try:
+    from numba import njit
+except ImportError:  # numba is optional; fall back to the pure-Python walk
+    njit = None
+
+
+def _score(X, split_feature, split_value, mass, size_limit):
+    """
+    Walk every row of X down every tree and score it against the given
+    masses: sum of mass * 2^depth along the path, stopping once a node's
+    mass drops below size_limit.
+    """
+    n_rows = X.shape[0]
+    n_trees, n_internal = split_feature.shape
+    scores = np.zeros(n_rows)
+    for r in range(n_rows):
+        s = 0.0
+        for t in range(n_trees):
+            node = 0
+            depth = 0
+            while True:
+                m = mass[t, node]
+                s += m * 2.0 ** depth
+                if m < size_limit or node >= n_internal:
+                    break  # Sparse node or leaf
+                if X[r, split_feature[t, node]] < split_value[t, node]:
+                    node = 2 * node + 1
+                else:
+                    node = 2 * node + 2
+                depth += 1
+        scores[r] = s
+    return scores
+
+
+def _count_mass(X, split_feature, split_value, mass):
+    """Increment the mass of every node each row of X visits"""
+    n_rows = X.shape[0]
+    n_trees, n_internal = split_feature.shape
+    for r in range(n_rows):
+        for t in range(n_trees):
+            node = 0
+            while True:
+                mass[t, node] += 1
+                if node >= n_internal:
+                    break  # Leaf
+                if X[r, split_feature[t, node]] < split_value[t, node]:
+                    node = 2 * node + 1
+                else:
+                    node = 2 * node + 2
+
+
+if njit is not None:
+    _score = njit(cache=True)(_score)
+    _count_mass = njit(cache=True)(_count_mass)
+
+
+# Only 'impact' varies between transactions
+_FACTOR_TEMPLATE = {
+    'description': 'Half-Space Trees anomaly detection',
+    'impact': 0.0,
+    'features_involved': ['composite_anomaly']
+}
+
 
 class HalfSpaceTreesExpert(BaseExpert):
-    def __init__(self, window_size=1000, n_trees=25):
+    """
+    Streaming anomaly detection with Half-Space Trees (Tan et al., 2011).
+    
+    Each tree is a complete binary tree of fixed height over a randomly
+    perturbed work space of the min-max normalized features. The latest
+    window_size transactions are buffered; when the window fills it becomes
+    the reference window: its feature ranges become the normalization frame
+    and its points are counted into the node masses under that frame. Points
+    are scored against the reference masses in the same frame, so points
+    landing in low-mass regions of the reference window are anomalous.
+    """
+    def __init__(self, window_size=1000, n_trees=25, height=15, seed=None):
         super().__init__("half_space_trees", "streaming_anomaly")
         self.window_size = window_size
         self.n_trees = n_trees
-        self.trees = []
-        self.reference_window = deque(maxlen=window_size)
-        self._initialize_trees()
-        
-    def _initialize_trees(self):
-        """Initialize Half-Space Trees"""
-        for _ in range(self.n_trees):
-            tree = {
-                'left_mass': 0,
-                'right_mass': 0,
-                'split_feature': None,
-                'split_value': None
-            }
-            self.trees.append(tree)
+        self.height = height
+        self.size_limit = 0.1 * window_size
+        self._rng = np.random.default_rng(seed)
+        # Trees are built on the first transaction once n_features is known
+        self._split_feature = None
+        self._split_value = None
+        self._mass_ref = None
+        # Raw features of the latest window, and the normalization frame of
+        # the reference window (None until the first window is full)
+        self._window = None
+        self._n_window = 0
+        self._feature_min = None
+        self._feature_span = None
+        # Score of a point whose every path node holds the full window
+        self._log_max_score = np.log1p(2 ** (height + 1) - 1)
     
-    def predict(self, transaction):
-        features = self._extract_features(transaction)
-        
-        # Update reference window
-        self.reference_window.append(features)
+    def _initialize_trees(self, n_features):
+        """Build n_trees complete trees of the given height, level by level"""
+        n_internal = 2 ** self.height - 1
+        n_nodes = 2 ** (self.height + 1) - 1
+        self._split_feature = np.empty((self.n_trees, n_internal), dtype=np.int32)
+        self._split_value = np.empty((self.n_trees, n_internal), dtype=np.float32)
         
-        # Score transaction using Half-Space Trees
-        score = self._calculate_anomaly_score(features)
+        for t in range(self.n_trees):
+            # Random work range per feature that still covers [0, 1]
+            sq = self._rng.uniform(size=n_features)
+            work_range = 2 * np.maximum(sq, 1 - sq)
+            low = (sq - work_range)[np.newaxis]
+            high = (sq + work_range)[np.newaxis]
+            
+            for level in range(self.height):
+                first = 2 ** level - 1
+                n_level = 2 ** level
+                rows = np.arange(n_level)
+                
+                features = self._rng.integers(n_features, size=n_level)
+                values = (low[rows, features] + high[rows, features]) / 2
+                self._split_feature[t, first:first + n_level] = features
+                self._split_value[t, first:first + n_level] = values
+                
+                # Children of node i are 2i+1 (below split) and 2i+2
+                low = np.repeat(low, 2, axis=0)
+                high = np.repeat(high, 2, axis=0)
+                high[2 * rows, features] = values
+                low[2 * rows + 1, features] = values
         
-        factors = [{
-            'description': f'Half-Space Trees anomaly detection',
-            'impact': score,
-            'features_involved': ['composite_anomaly']
-        }]
+        self._mass_ref = np.zeros((self.n_trees, n_nodes), dtype=np.int32)
+        self._window = np.empty((self.window_size, n_features), dtype=np.float32)
+    
+    def predict(self, transaction, features=None):
+        if features is not None:
+            features = features[np.newaxis]
+        return self.predict_batch([transaction], features)[0]
+    
+    def predict_batch(self, transactions, features=None):
+        X = self._features(transactions, features)
+        scores = self._calculate_anomaly_scores(X)
         
-        return ExpertDecision(
-            expert_name=self.name,
-            score=score,
-            confidence=min(1.0, abs(score) * 2),
-            contributing_factors=factors,
-            model_type=self.model_type
-        )
+        return [
+            ExpertDecision.model_construct(
+                expert_name=self.name,
+                score=score,
+                confidence=min(1.0, abs(score) * 2),
+                contributing_factors=[{**_FACTOR_TEMPLATE, 'impact': score}],
+                model_type=self.model_type
+            )
+            for score in scores
+        ]
     
-    def _extract_features(self, transaction):
-        """Extract numerical features from transaction"""
-        feature_values = list(transaction.features.values())
-        # Add engineered features
-        feature_values.extend([
-            transaction.amount / 1000,
-            len(transaction.customer_id) / 100,
-            hash(transaction.merchant_id) % 100 / 100
-        ])
-        return np.array(feature_values)
+    def _normalize(self, X):
+        """Min-max normalize in the reference window's frame"""
+        return (X - self._feature_min) / self._feature_span
+    
+    def _swap_windows(self):
+        """Make the buffered latest window the reference window"""
+        window = self._window
+        self._feature_min = window.min(axis=0)
+        span = window.max(axis=0) - self._feature_min
+        self._feature_span = np.where(span > 0, span, 1).astype(np.float32)
+        
+        self._mass_ref[:] = 0
+        _count_mass(self._normalize(window), self._split_feature,
+                    self._split_value, self._mass_ref)
+        self._n_window = 0
     
-    def _calculate_anomaly_score(self, features):
-        """Calculate anomaly score using Half-Space Trees principle"""
-        if len(self.reference_window) < 10:
-            return 0.1  # Not enough data
+    def _calculate_anomaly_scores(self, X):
+        """Score a (B, n_features) matrix and buffer it into the latest window"""
+        if self._split_feature is None:
+            self._initialize_trees(X.shape[1])
         
-        # Simple mass-based anomaly detection
-        # Points in sparse regions are more anomalous
-        distances = []
-        for ref_point in list(self.reference_window)[-100:]:  # Recent points
-            distance = np.linalg.norm(features - ref_point)
-            distances.append(distance)
+        scores = np.empty(len(X))
         
-        # Normalize distance to [0, 1] range
-        if distances:
-            avg_distance = np.mean(distances)
-            max_distance = np.max(distances) if len(distances) > 1 else 1.0
-            score = min(1.0, avg_distance / max_distance if max_distance > 0 else 0)
-        else:
-            score = 0.1
+        # Process the batch in chunks that end on window boundaries
+        start = 0
+        while start < len(X):
+            end = min(len(X), start + self.window_size - self._n_window)
+            chunk = X[start:end]
+            
+            if self._feature_min is None:
+                scores[start:end] = 0.1  # Not enough data
+            else:
+                # Scored points never move the frame or the reference masses
+                raw = _score(
+                    self._normalize(chunk), self._split_feature, self._split_value,
+                    self._mass_ref, self.size_limit
+                )
+                # Mass is weighted by 2^depth, so compare on a log scale;
+                # the mapping decreases with mass, so high mass means normal
+                per_tree = raw / (self.n_trees * self.window_size)
+                scores[start:end] = 1.0 - np.log1p(per_tree) / self._log_max_score
+            
+            self._window[self._n_window:self._n_window + len(chunk)] = chunk
+            self._n_window += len(chunk)
+            if self._n_window == self.window_size:
+                self._swap_windows()
+            start = end
         
-        return score
+        return scores.tolist()
     
     def update(self, transaction, true_label):
         """Update model with new labeled data"""
         # Half-Space Trees don't typically update with labels
         # But we can adjust based on feedback
-        pass
\ No newline at end of file
+        pass
@@ -1,4 +1,5 @@
 # detection_engine/experts/rule_engine.py
+import numpy as np
 from .base_expert import BaseExpert
 from shared.schemas import ExpertDecision
 
@@ -6,61 +7,83 @@ class RuleEngineExpert(BaseExpert):
     def __init__(self):
         super().__init__("rule_engine", "rule_based")
         self.rules = self._load_rules()
+        # Rule weights aligned with the columns of the (B, R) trigger mask
+        self.weights = np.array([rule['weight'] for rule in self.rules], dtype=np.float64)
+        # Contributing factor for each rule, built once and shared by every decision
+        for rule in self.rules:
+            rule['factor'] = {
+                'description': rule['description'],
+                'impact': rule['weight'],
+                'features_involved': ['rule_based']
+            }
     
     def _load_rules(self):
+        # Each condition is a vectorized predicate over the batch feature columns
         return [
             {
                 'name': 'high_amount',
-                'condition': lambda t: t.amount > 1000,
+                'condition': lambda cols: cols['amount'] > 1000,
                 'weight': 0.7,
                 'description': 'Transaction amount exceeds $1000'
             },
             {
                 'name': 'new_location', 
-                'condition': lambda t: self._is_new_location(t),
+                'condition': lambda cols: self._is_new_location(cols),
                 'weight': 0.5,
                 'description': 'Transaction from new geographic location'
             },
             {
                 'name': 'velocity_anomaly',
-                'condition': lambda t: self._check_velocity(t),
+                'condition': lambda cols: self._check_velocity(cols),
                 'weight': 0.6,
                 'description': 'Unusual transaction frequency'
             }
         ]
     
-    def predict(self, transaction):
-        score = 0.0
-        triggered_rules = []
+    def predict(self, transaction, features=None):
+        return self.predict_batch([transaction])[0]
+    
+    def predict_batch(self, transactions, features=None):
+        # Rules read transaction fields directly, not the shared feature matrix
+        cols = self._extract_columns(transactions)
         
-        for rule in self.rules:
-            if rule['condition'](transaction):
-                score += rule['weight']
-                triggered_rules.append(rule)
+        # (B, R) matrix of triggered rules
+        mask = np.column_stack([rule['condition'](cols) for rule in self.rules])
         
         # Normalize score
-        score = min(1.0, score)
+        scores = np.minimum(mask @ self.weights, 1.0)
         
-        factors = []
-        for rule in triggered_rules:
-            factors.append({
-                'description': rule['description'],
-                'impact': rule['weight'],
-                'features_involved': ['rule_based']
-            })
+        decisions = []
+        for row, score in zip(mask, scores):
+            decisions.append(ExpertDecision.model_construct(
+                expert_name=self.name,
+                score=float(score),
+                confidence=1.0,  # Rules are deterministic
+                contributing_factors=[self.rules[r]['factor'] for r in np.flatnonzero(row)],
+                model_type=self.model_type
+            ))
         
-        return ExpertDecision(
-            expert_name=self.name,
-            score=score,
-            confidence=1.0,  # Rules are deterministic
-            contributing_factors=factors,
-            model_type=self.model_type
-        )
+        return decisions
+    
+    def _extract_columns(self, transactions):
+        """Build the per-rule input columns for a batch of transactions"""
+        n = len(transactions)
+        return {
+            'amount': np.fromiter((t.amount for t in transactions), dtype=np.float64, count=n),
+            'location_hash': np.fromiter(
+                (t.location_hash for t in transactions),
+                dtype=np.uint64, count=n
+            ),
+            'velocity_hash': np.fromiter(
+                (t.customer_hash ^ int(t.timestamp.timestamp()) for t in transactions),
+                dtype=np.uint64, count=n
+            )
+        }
     
-    def _is_new_location(self, transaction):
+    def _is_new_location(self, cols):
         # Mock location check
-        return hash(transaction.location) % 10 == 0  # 10% chance
+        return cols['location_hash'] % 10 == 0  # 10% chance
     
-    def _check_velocity(self, transaction):
+    def _check_velocity(self, cols):
         # Mock velocity check  
-        return hash(transaction.customer_id + transaction.timestamp.isoformat()) % 5 == 0
\ No newline at end of file
+        return cols['velocity_hash'] % 5 == 0
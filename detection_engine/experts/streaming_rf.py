@@ -10,7 +10,13 @@ class StreamingRFExpert(BaseExpert):
         super().__init__("streaming_rf", "streaming")
         self.window_size = window_size
         self.n_estimators = n_estimators
-        self.data_window = deque(maxlen=window_size)
+        # Nothing trains from the data window yet, so don't record it; when
+        # enabled it is a (window_size, n_features) ring buffer allocated on
+        # the first transaction
+        self._window_needed = False
+        self._buf = None
+        self._idx = 0
+        self._filled = 0
         self.label_window = deque(maxlen=window_size)
         self.models = []  # In production, use actual streaming RF
         self._initialize_models()
@@ -24,11 +30,21 @@ class StreamingRFExpert(BaseExpert):
             {'feature': 'location_risk', 'threshold': 0.8, 'weight': 0.5}
         ]
     
+    def _append_to_window(self, features):
+        """Write features into the ring buffer, overwriting the oldest row"""
+        if self._buf is None:
+            self._buf = np.empty((self.window_size, len(features)), dtype=np.float32)
+        
+        self._buf[self._idx] = features
+        self._idx = (self._idx + 1) % self.window_size
+        self._filled = min(self._filled + 1, self.window_size)
+    
     def predict(self, transaction):
         features = self._extract_features(transaction)
         
         # Update data window
-        self.data_window.append(features)
+        if self._window_needed:
+            self._append_to_window(features)
         
         # Calculate score based on adaptive rules
         score = self._calculate_streaming_score(transaction, features)
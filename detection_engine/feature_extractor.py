@@ -0,0 +1,52 @@
+# detection_engine/feature_extractor.py
+import numpy as np
+from typing import List
+from shared.schemas import Transaction
+
+# Engineered features appended after the raw transaction features, as
+# negative column offsets from the end of each row
+AMOUNT = -3  # amount / 1000
+CUSTOMER_ID_LENGTH = -2  # len(customer_id) / 100
+MERCHANT_BUCKET = -1  # merchant hash bucket in [0, 1)
+N_ENGINEERED = 3
+
+
+class FeatureExtractor:
+    """
+    Builds the float32 feature matrix shared by every expert.
+    
+    Features are extracted once per micro-batch upstream of the ensemble and
+    the same array is handed to each expert, instead of every expert
+    re-deriving them from the transaction.
+    """
+    def __init__(self, max_batch_size: int = 64):
+        self.max_batch_size = max_batch_size
+        # Reused output buffer, allocated once n_features is known
+        self._buf = None
+    
+    def extract(self, transaction: Transaction) -> np.ndarray:
+        """Feature vector for a single transaction (a fresh array)"""
+        return self.extract_batch([transaction])[0].copy()
+    
+    def extract_batch(self, transactions: List[Transaction]) -> np.ndarray:
+        """
+        (B, D) feature matrix for a batch of transactions.
+        
+        The result is a view of an internal buffer that is overwritten by the
+        next call; experts must not keep a reference to it.
+        """
+        n_rows = len(transactions)
+        n_raw = len(transactions[0].features)
+        n_features = n_raw + N_ENGINEERED
+        
+        if self._buf is None or self._buf.shape[1] != n_features or self._buf.shape[0] < n_rows:
+            self._buf = np.empty((max(self.max_batch_size, n_rows), n_features), dtype=np.float32)
+        
+        for i, transaction in enumerate(transactions):
+            row = self._buf[i]
+            row[:n_raw] = transaction.feature_vec
+            row[AMOUNT] = transaction.amount / 1000
+            row[CUSTOMER_ID_LENGTH] = len(transaction.customer_id) / 100
+            row[MERCHANT_BUCKET] = transaction.merchant_hash % 100 / 100
+        
+        return self._buf[:n_rows]
@@ -10,12 +10,52 @@ from .experts import (
     StreamingRFExpert,
     HalfSpaceTreesExpert
 )
-from .weight_manager import ContextualBanditWeightManager
-from shared.redis_client import redis_client
-from shared.schemas import Transaction, EnsembleDecision
+from .weight_manager import ContextualBanditWeightManager, warm_up_linucb_kernels
+from .feature_extractor import FeatureExtractor
+from shared.redis_client import (
+    redis_client, pubsub_client, ALERTS_STREAM, ALERTS_STREAM_MAXLEN, PUBSUB_POLL_TIMEOUT,
+    WEIGHT_UPDATES_STREAM, WEIGHT_UPDATES_GROUP
+)
+from shared.schemas import Transaction, ExpertDecision, EnsembleDecision
+import heapq
 import json
+import orjson
+import socket
 import time
+import numpy as np
+from collections import defaultdict
+from functools import lru_cache
+from redis.exceptions import ResponseError
 from typing import Dict, List
+from xxhash import xxh3_64_intdigest
+
+# Micro-batching of the transaction stream before expert scoring: a batch
+# takes the transactions that arrive within the window of the first one
+MICRO_BATCH_SIZE = 64
+MICRO_BATCH_WINDOW = 0.005  # seconds
+
+# Pace of the simulated stream, one transaction per delay
+SIMULATED_STREAM_DELAY = 0.1  # seconds
+
+# Background Redis write batches allowed in flight before scoring waits
+MAX_PENDING_WRITES = 64
+
+# Analyst feedback is buffered and applied to the bandits in batches
+FEEDBACK_BATCH_SIZE = 256
+FEEDBACK_BATCH_WINDOW = 0.05  # seconds
+
+# Weight updates read from the stream per XREADGROUP call
+WEIGHT_UPDATES_READ_COUNT = 16
+WEIGHT_UPDATES_READ_BLOCK_MS = 5000
+
+
+@lru_cache(maxsize=65536)
+def _risk_bucket(value: str) -> float:
+    """Stable [0, 1) risk bucket for a merchant/location/device id"""
+    # Merchants, locations and devices repeat across the stream, so each
+    # distinct id is hashed once
+    return (xxh3_64_intdigest(value.encode()) % 100) / 100
+
 
 class DetectionEngine:
     def __init__(self):
@@ -27,17 +67,40 @@ class DetectionEngine:
             'half_space': HalfSpaceTreesExpert()
         }
         
+        # Features are extracted once per batch and shared by all experts
+        self.feature_extractor = FeatureExtractor(max_batch_size=MICRO_BATCH_SIZE)
+        
+        # Column order of every (B, E) score and weight matrix
+        self._expert_order = tuple(self.experts.keys())
+        
         self.weight_manager = ContextualBanditWeightManager(
-            list(self.experts.keys()),
+            list(self._expert_order),
             context_dim=10
         )
         
+        # Compile the bandit kernels now rather than on the first transaction
+        warm_up_linucb_kernels(self.weight_manager.context_dim)
+        
         # Build Pathway pipeline
         self.pipeline = build_fraud_pipeline(self.experts, self.weight_manager)
         
         # Kill switch state
         self.kill_switch_active = False
         
+        # In-flight background Redis writes
+        self.pending_writes = set()
+        
+        # Feedback waiting for the next batched bandit update
+        self.feedback_buffer = []
+        self._feedback_flush = None
+        
+        # Control channel -> handler, all served by one pubsub connection.
+        # Weight updates arrive on a stream instead
+        self._control_handlers = {
+            'feedback': self.buffer_feedback,
+            'kill_switch': self.handle_kill_switch
+        }
+        
     async def start(self):
         """Start all background tasks"""
         print("🚀 Starting Detection Engine...")
@@ -45,39 +108,87 @@ class DetectionEngine:
         # Start concurrent tasks
         await asyncio.gather(
             self.process_transaction_stream(),
-            self.listen_for_feedback(),
-            self.listen_for_weight_updates(),
-            self.listen_for_kill_switch()
+            self.listen_for_control_messages(),
+            self.listen_for_weight_updates()
         )
         
     async def process_transaction_stream(self):
         """Main processing loop for transaction stream"""
         print("📊 Transaction processing started")
         
-        # Simulate transaction stream from Kaggle dataset
-        transactions = self.simulate_kaggle_stream()
+        # Simulate transaction stream from Kaggle dataset. The simulator feeds
+        # a bounded queue at its own pace, so batching only groups what has
+        # actually arrived
+        queue = asyncio.Queue(maxsize=MICRO_BATCH_SIZE * 4)
+        producer = asyncio.create_task(
+            self._feed_stream(self.simulate_kaggle_stream(), queue)
+        )
+        try:
+            while True:
+                # Check kill switch; nothing is taken off the queue while it
+                # is active, so the stream waits instead of being dropped
+                if self.kill_switch_active:
+                    print("🛑 Kill switch active - pausing transaction processing")
+                    await asyncio.sleep(1)
+                    continue
+                
+                batch = await self._next_micro_batch(queue)
+                if batch is None:
+                    break
+                await self._process_batch(batch)
+        finally:
+            producer.cancel()
+    
+    async def _process_batch(self, batch: List[Transaction]):
+        """Score a micro-batch and queue its Redis writes"""
+        start_time = time.time()
         
-        for transaction in transactions:
-            # Check kill switch
-            if self.kill_switch_active:
-                print("🛑 Kill switch active - skipping transaction processing")
-                await asyncio.sleep(1)
-                continue
+        try:
+            # Get expert predictions for the whole micro-batch at once
+            features = self.feature_extractor.extract_batch(batch)
+            batch_decisions = {}
+            failed = np.zeros(len(self._expert_order), dtype=bool)
+            for j, expert_name in enumerate(self._expert_order):
+                decisions = self._predict_expert_batch(expert_name, batch, features)
+                if decisions is None:
+                    # A failed expert gets a placeholder decision and no weight
+                    failed[j] = True
+                    decisions = [self._fallback_decision(expert_name)] * len(batch)
+                batch_decisions[expert_name] = decisions
+            
+            if failed.all():
+                print(f"❌ No expert could score batch of {len(batch)} transactions")
+                return
             
-            start_time = time.time()
+            # Get context-aware weights for the whole batch
+            contexts = self.extract_context_batch(batch)
+            weight_matrix = self.weight_manager.select_experts_matrix(contexts)
+            weight_matrix[:, failed] = 0.0
             
+            # Ensemble scores for the whole batch
+            score_matrix = np.array([
+                [decision.score for decision in batch_decisions[expert_name]]
+                for expert_name in self._expert_order
+            ]).T
+            ensemble_scores = self.combine_predictions(score_matrix, weight_matrix).tolist()
+            score_variances = score_matrix[:, ~failed].var(axis=1).tolist()
+            batch_weights = weight_matrix.tolist()
+        except Exception as e:
+            print(f"❌ Error scoring batch of {len(batch)} transactions: {e}")
+            return
+        
+        # Redis writes for the batch, sent in one pipelined round trip
+        records = []
+        
+        for i, transaction in enumerate(batch):
             try:
-                # Get expert predictions with explanations
-                expert_decisions = {}
-                for expert_name, expert in self.experts.items():
-                    expert_decisions[expert_name] = expert.predict(transaction)
-                
-                # Get context-aware weights
-                context = self.extract_context(transaction)
-                weights = self.weight_manager.select_experts(context)
+                expert_decisions = {
+                    expert_name: decisions[i]
+                    for expert_name, decisions in batch_decisions.items()
+                }
                 
-                # Ensemble decision
-                ensemble_score = self.combine_predictions(expert_decisions, weights)
+                weights = dict(zip(self._expert_order, batch_weights[i]))
+                ensemble_score = ensemble_scores[i]
                 
                 # Build rich context for explanation
                 ensemble_decision = EnsembleDecision(
@@ -86,101 +197,286 @@ class DetectionEngine:
                     expert_decisions=expert_decisions,
                     weights=weights,
                     primary_factors=self.identify_primary_factors(expert_decisions),
-                    needs_human_review=0.3 <= ensemble_score <= 0.7
+                    needs_human_review=0.3 <= ensemble_score <= 0.7,
+                    score_variance=score_variances[i]
                 )
                 
-                # **FIX 1: Store decisions in Redis for feedback loop**
-                await redis_client.setex(
-                    f"decisions:{transaction.transaction_id}",
-                    86400,  # 24 hour TTL
-                    json.dumps({
-                        k: v.dict() for k, v in expert_decisions.items()
-                    })
-                )
-                
-                # **FIX 2: Store transaction for feedback correlation**
-                await redis_client.setex(
-                    f"transaction:{transaction.transaction_id}",
-                    86400,
-                    json.dumps(transaction.dict(), default=str)
-                )
+                # Serialize the transaction once; the stored copy and
+                # the alert payload share the same bytes
+                transaction_json = transaction.model_dump_json().encode()
                 
                 # Publish alert to Redis for explanation service
-                alert_data = {
-                    'transaction': transaction.dict(),
-                    'ensemble_decision': ensemble_decision.dict(),
+                alert_json = orjson.dumps({
+                    'transaction': orjson.Fragment(transaction_json),
+                    'ensemble_decision': orjson.Fragment(
+                        ensemble_decision.model_dump_json()
+                    ),
                     'processing_time': time.time() - start_time
-                }
+                })
                 
-                await redis_client.publish('alerts', json.dumps(alert_data, default=str))
+                records.append((
+                    transaction.transaction_id,
+                    orjson.dumps(
+                        {k: v.model_dump() for k, v in expert_decisions.items()},
+                        default=str,
+                        option=orjson.OPT_SERIALIZE_NUMPY
+                    ),
+                    transaction_json,
+                    alert_json
+                ))
                 
                 print(f"✅ Processed {transaction.transaction_id} - Score: {ensemble_score:.3f}")
                 
             except Exception as e:
                 print(f"❌ Error processing transaction {transaction.transaction_id}: {e}")
+        
+        # Write in the background so the next batch can be scored
+        # while this one is in flight
+        if records:
+            await self._submit_write(self._persist_and_publish(records))
+    
+    async def _persist_and_publish(self, records):
+        """Store decisions and transactions and publish alerts for a batch"""
+        async with redis_client.pipeline(transaction=False) as pipe:
+            for transaction_id, decisions_json, transaction_json, alert_json in records:
+                # **FIX 1: Store decisions in Redis for feedback loop**
+                pipe.setex(
+                    f"decisions:{transaction_id}",
+                    86400,  # 24 hour TTL
+                    decisions_json
+                )
+                
+                # **FIX 2: Store transaction for feedback correlation**
+                pipe.setex(f"transaction:{transaction_id}", 86400, transaction_json)
+                
+                pipe.xadd(
+                    ALERTS_STREAM, {'p': alert_json},
+                    maxlen=ALERTS_STREAM_MAXLEN, approximate=True
+                )
+            
+            await pipe.execute()
+    
+    async def _submit_write(self, coro):
+        """Run a Redis write as a background task, bounding how many are in flight"""
+        if len(self.pending_writes) >= MAX_PENDING_WRITES:
+            await asyncio.wait(self.pending_writes, return_when=asyncio.FIRST_COMPLETED)
+        
+        task = asyncio.create_task(coro)
+        self.pending_writes.add(task)
+        task.add_done_callback(self._on_write_done)
+    
+    def _on_write_done(self, task: asyncio.Task):
+        self.pending_writes.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            print(f"❌ Error writing to Redis: {task.exception()}")
+    
+    async def _feed_stream(self, transactions, queue: asyncio.Queue):
+        """Put simulated transactions on the queue at the simulated pace"""
+        for transaction in transactions:
+            await queue.put(transaction)
             
             # Simulate streaming delay
-            await asyncio.sleep(0.1)
+            await asyncio.sleep(SIMULATED_STREAM_DELAY)
+        await queue.put(None)  # End of stream
+    
+    async def _next_micro_batch(self, queue: asyncio.Queue):
+        """Wait for a transaction, then add up to MICRO_BATCH_SIZE of those
+        queued or arriving within MICRO_BATCH_WINDOW. None at the end of the
+        stream"""
+        first = await queue.get()
+        if first is None:
+            return None
+        
+        batch = [first]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + MICRO_BATCH_WINDOW
+        while len(batch) < MICRO_BATCH_SIZE:
+            try:
+                if queue.empty():
+                    transaction = await asyncio.wait_for(
+                        queue.get(), max(0.0, deadline - loop.time())
+                    )
+                else:
+                    transaction = queue.get_nowait()
+            except asyncio.TimeoutError:
+                break
+            if transaction is None:
+                queue.put_nowait(None)  # Leave the end marker for the next call
+                break
+            batch.append(transaction)
+        return batch
+    
+    def _predict_expert_batch(self, expert_name: str, batch: List[Transaction],
+                              features: np.ndarray):
+        """One expert's decisions for the batch, or None if it failed, so one
+        broken expert does not discard the batch for the others"""
+        try:
+            return self.experts[expert_name].predict_batch(batch, features)
+        except Exception as e:
+            print(f"❌ Error scoring batch with {expert_name}: {e}")
+            return None
+    
+    def _fallback_decision(self, expert_name: str) -> ExpertDecision:
+        """Placeholder decision for an expert that failed to score"""
+        return ExpertDecision.model_construct(
+            expert_name=expert_name,
+            score=0.0,
+            confidence=0.0,
+            contributing_factors=[],
+            model_type=self.experts[expert_name].model_type
+        )
+    
+    async def listen_for_control_messages(self):
+        """Listen for feedback and kill switch commands"""
+        # One connection for both channels; subscribe acks are dropped
+        # by redis-py rather than returned
+        pubsub = pubsub_client.pubsub(ignore_subscribe_messages=True)
+        await pubsub.subscribe(*self._control_handlers)
+        
+        print("👂 Listening for analyst feedback and kill switch...")
+        
+        while True:
+            message = await pubsub.get_message(timeout=PUBSUB_POLL_TIMEOUT)
+            if message is None:
+                continue
+            channel = message['channel']
+            try:
+                data = json.loads(message['data'])
+            except Exception as e:
+                print(f"❌ Error decoding {channel} message: {e}")
+                continue
+            await self._control_handlers[channel](data)
     
-    async def listen_for_feedback(self):
-        """Listen for real-time feedback from dashboard"""
-        pubsub = redis_client.pubsub()
-        await pubsub.subscribe('feedback')
+    async def listen_for_weight_updates(self):
+        """Apply batch weight updates from the feedback loop's stream"""
+        try:
+            await redis_client.xgroup_create(
+                WEIGHT_UPDATES_STREAM, WEIGHT_UPDATES_GROUP, id='$', mkstream=True
+            )
+        except ResponseError as e:
+            if 'BUSYGROUP' not in str(e):
+                raise
         
-        print("👂 Listening for analyst feedback...")
+        # Stable per container, so a restarted engine finds its own pending updates
+        consumer = socket.gethostname()
         
-        async for message in pubsub.listen():
-            if message['type'] == 'message':
+        # Start with updates delivered to this consumer but never acknowledged,
+        # then switch to new ones
+        stream_id = '0'
+        while True:
+            try:
+                response = await redis_client.xreadgroup(
+                    WEIGHT_UPDATES_GROUP, consumer, {WEIGHT_UPDATES_STREAM: stream_id},
+                    count=WEIGHT_UPDATES_READ_COUNT, block=WEIGHT_UPDATES_READ_BLOCK_MS
+                )
+            except Exception as e:
+                print(f"❌ Error reading weight updates: {e}")
+                await asyncio.sleep(1)
+                continue
+            
+            entries = response[0][1] if response else []
+            if stream_id == '0' and not entries:
+                stream_id = '>'
+                continue
+            
+            for _, fields in entries:
                 try:
-                    feedback_data = json.loads(message['data'])
-                    await self.process_feedback(feedback_data)
+                    weight_updates = orjson.loads(fields['w'])
                 except Exception as e:
-                    print(f"❌ Error processing feedback: {e}")
+                    print(f"❌ Error decoding weight update: {e}")
+                    continue
+                await self.handle_weight_updates(weight_updates)
+            
+            if entries:
+                await redis_client.xack(
+                    WEIGHT_UPDATES_STREAM, WEIGHT_UPDATES_GROUP,
+                    *[entry_id for entry_id, _ in entries]
+                )
+    
+    async def buffer_feedback(self, feedback_data: Dict):
+        """Queue real-time feedback from dashboard for the next bandit update"""
+        self.feedback_buffer.append(feedback_data)
+        
+        if len(self.feedback_buffer) >= FEEDBACK_BATCH_SIZE:
+            await self._flush_feedback()
+        elif self._feedback_flush is None:
+            # First event of a batch: apply it within FEEDBACK_BATCH_WINDOW
+            self._feedback_flush = asyncio.create_task(
+                self._flush_feedback_after(FEEDBACK_BATCH_WINDOW)
+            )
+    
+    async def _flush_feedback_after(self, delay: float):
+        await asyncio.sleep(delay)
+        self._feedback_flush = None
+        await self._flush_feedback()
+    
+    async def _flush_feedback(self):
+        """Apply all buffered feedback to the bandits"""
+        if self._feedback_flush is not None:
+            self._feedback_flush.cancel()
+            self._feedback_flush = None
+        
+        feedback_batch, self.feedback_buffer = self.feedback_buffer, []
+        if not feedback_batch:
+            return
+        
+        try:
+            await self.process_feedback_batch(feedback_batch)
+        except Exception as e:
+            print(f"❌ Error processing feedback batch of {len(feedback_batch)}: {e}")
     
     async def process_feedback(self, feedback_data: Dict):
         """Process feedback and update weights immediately"""
-        alert_id = feedback_data['alert_id']
-        correct_label = feedback_data['correct_label']
-        
-        # Get stored transaction and decisions
-        transaction_data = await redis_client.get(f"transaction:{alert_id}")
-        decisions_data = await redis_client.get(f"decisions:{alert_id}")
+        await self.process_feedback_batch([feedback_data])
+    
+    async def process_feedback_batch(self, feedback_batch: List[Dict]):
+        """Update the bandits from a batch of analyst feedback"""
+        # Get stored transactions and decisions in one round trip
+        async with redis_client.pipeline(transaction=False) as pipe:
+            for feedback_data in feedback_batch:
+                alert_id = feedback_data['alert_id']
+                pipe.get(f"transaction:{alert_id}")
+                pipe.get(f"decisions:{alert_id}")
+            stored = await pipe.execute()
+        
+        transactions = []
+        expert_decisions = []
+        correct_labels = []
+        for i, feedback_data in enumerate(feedback_batch):
+            alert_id = feedback_data['alert_id']
+            transaction_data, decisions_data = stored[2 * i], stored[2 * i + 1]
+            
+            if not transaction_data or not decisions_data:
+                print(f"⚠️ Missing data for alert {alert_id}")
+                continue
+            
+            # Reconstruct transaction and decisions
+            transactions.append(Transaction.model_validate_json(transaction_data))
+            expert_decisions.append(json.loads(decisions_data))
+            correct_labels.append(feedback_data['correct_label'])
         
-        if not transaction_data or not decisions_data:
-            print(f"⚠️ Missing data for alert {alert_id}")
+        if not transactions:
             return
         
-        # Reconstruct transaction and decisions
-        transaction = Transaction(**json.loads(transaction_data))
-        expert_decisions = json.loads(decisions_data)
-        
         # Extract context
-        context = self.extract_context(transaction)
+        contexts = self.extract_context_batch(transactions)
         
         # **FIX 3: Update contextual bandit with feedback**
-        self.weight_manager.update_with_feedback(
-            context,
+        self.weight_manager.update_with_feedback_batch(
+            contexts,
             expert_decisions,
-            correct_label,
-            importance_weight=1.0
+            correct_labels,
+            importance_weights=[1.0] * len(transactions)
         )
         
-        print(f"🔄 Updated weights from feedback for alert {alert_id}")
+        print(f"🔄 Updated weights from feedback for {len(transactions)} alerts")
     
-    async def listen_for_weight_updates(self):
-        """Listen for batch weight updates from feedback loop"""
-        pubsub = redis_client.pubsub()
-        await pubsub.subscribe('weight_updates')
-        
-        print("👂 Listening for weight updates...")
-        
-        async for message in pubsub.listen():
-            if message['type'] == 'message':
-                try:
-                    weight_updates = json.loads(message['data'])
-                    await self.apply_weight_updates(weight_updates)
-                except Exception as e:
-                    print(f"❌ Error applying weight updates: {e}")
+    async def handle_weight_updates(self, weight_updates: Dict):
+        """Batch weight updates from feedback loop"""
+        try:
+            await self.apply_weight_updates(weight_updates)
+        except Exception as e:
+            print(f"❌ Error applying weight updates: {e}")
     
     async def apply_weight_updates(self, weight_updates: Dict):
         """Apply batch weight updates from online learning"""
@@ -197,77 +493,73 @@ class DetectionEngine:
         
         print("✅ Weight updates applied")
     
-    async def listen_for_kill_switch(self):
-        """Listen for kill switch commands from dashboard"""
-        pubsub = redis_client.pubsub()
-        await pubsub.subscribe('kill_switch')
-        
-        print("👂 Listening for kill switch...")
-        
-        async for message in pubsub.listen():
-            if message['type'] == 'message':
-                try:
-                    command = json.loads(message['data'])
-                    self.kill_switch_active = command.get('active', False)
-                    
-                    if self.kill_switch_active:
-                        print("🛑 KILL SWITCH ACTIVATED - Pausing detections")
-                    else:
-                        print("✅ Kill switch deactivated - Resuming detections")
-                        
-                except Exception as e:
-                    print(f"❌ Error processing kill switch: {e}")
+    async def handle_kill_switch(self, command: Dict):
+        """Kill switch commands from dashboard"""
+        try:
+            self.kill_switch_active = command.get('active', False)
+            
+            if self.kill_switch_active:
+                print("🛑 KILL SWITCH ACTIVATED - Pausing detections")
+            else:
+                print("✅ Kill switch deactivated - Resuming detections")
+                
+        except Exception as e:
+            print(f"❌ Error processing kill switch: {e}")
     
-    def extract_context(self, transaction: Transaction) -> List[float]:
+    def extract_context(self, transaction: Transaction) -> np.ndarray:
         """Extract context for bandit decision"""
-        # Build 10-dimensional context vector
-        context = [
-            transaction.amount / 1000,  # Normalized amount
-            len(transaction.customer_id) % 100 / 100,  # Customer feature
-            hash(transaction.merchant_id) % 100 / 100,  # Merchant risk
-            hash(transaction.location) % 100 / 100,  # Location risk
-            hash(transaction.device_id) % 100 / 100,  # Device risk
-            transaction.timestamp.hour / 24,  # Time of day
-            transaction.timestamp.weekday() / 7,  # Day of week
-            len(transaction.features) / 30,  # Feature dimensionality
-            sum(abs(v) for v in transaction.features.values()) / 100,  # Feature magnitude
-            1.0 if transaction.transaction_type == "purchase" else 0.0  # Transaction type
-        ]
-        
-        return context[:10]  # Ensure exactly 10 dimensions
+        return self.extract_context_batch([transaction])[0]
     
-    def combine_predictions(self, expert_decisions: Dict, weights: Dict) -> float:
-        """Weighted ensemble combination"""
-        weighted_sum = 0.0
-        total_weight = 0.0
-        
-        for expert_name, decision in expert_decisions.items():
-            weight = weights.get(expert_name, 0.0)
-            weighted_sum += decision.score * weight
-            total_weight += weight
-        
-        return weighted_sum / total_weight if total_weight > 0 else 0.0
+    def extract_context_batch(self, transactions: List[Transaction]) -> np.ndarray:
+        """Extract (B, 10) bandit contexts for a batch of transactions"""
+        n = len(transactions)
+        
+        def column(values):
+            return np.fromiter(values, dtype=np.float64, count=n)
+        
+        # Build 10-dimensional context vectors
+        return np.column_stack([
+            column(t.amount for t in transactions) / 1000,  # Normalized amount
+            column(len(t.customer_id) % 100 for t in transactions) / 100,  # Customer feature
+            column(_risk_bucket(t.merchant_id) for t in transactions),  # Merchant risk
+            column(_risk_bucket(t.location) for t in transactions),  # Location risk
+            column(_risk_bucket(t.device_id) for t in transactions),  # Device risk
+            column(t.timestamp.hour for t in transactions) / 24,  # Time of day
+            column(t.timestamp.weekday() for t in transactions) / 7,  # Day of week
+            column(len(t.features) for t in transactions) / 30,  # Feature dimensionality
+            column(sum(map(abs, t.features.values())) for t in transactions) / 100,  # Feature magnitude
+            column(t.transaction_type == "purchase" for t in transactions)  # Transaction type
+        ])
+    
+    def combine_predictions(self, scores: np.ndarray, weights: np.ndarray) -> np.ndarray:
+        """Weighted ensemble combination of (..., E) scores, in _expert_order"""
+        weighted_sum = np.sum(scores * weights, axis=-1)
+        total_weight = np.sum(weights, axis=-1)
+        
+        return np.divide(
+            weighted_sum, total_weight,
+            out=np.zeros_like(weighted_sum),
+            where=total_weight > 0
+        )
     
     def identify_primary_factors(self, expert_decisions: Dict) -> List[Dict]:
         """Identify cross-expert important factors"""
-        factor_scores = {}
+        # description -> [total impact, experts]
+        factor_scores = defaultdict(lambda: [0.0, []])
         
         for expert_name, decision in expert_decisions.items():
             for factor in decision.contributing_factors:
-                key = factor['description']
-                if key not in factor_scores:
-                    factor_scores[key] = {'impact': 0.0, 'experts': []}
-                factor_scores[key]['impact'] += abs(factor['impact'])
-                factor_scores[key]['experts'].append(expert_name)
+                scores = factor_scores[factor['description']]
+                scores[0] += abs(factor['impact'])
+                scores[1].append(expert_name)
         
         # Return top 3 factors
-        sorted_factors = sorted(
-            [{'description': k, **v} for k, v in factor_scores.items()],
-            key=lambda x: x['impact'],
-            reverse=True
-        )[:3]
-        
-        return sorted_factors
+        return [
+            {'description': k, 'impact': impact, 'experts': experts}
+            for k, (impact, experts) in heapq.nlargest(
+                3, factor_scores.items(), key=lambda item: item[1][0]
+            )
+        ]
     
     def simulate_kaggle_stream(self):
         """Simulate streaming from Kaggle dataset"""
@@ -283,22 +575,41 @@ class DetectionEngine:
             df = self._generate_mock_data()
         
         base_time = datetime.now()
-        
-        for idx, row in df.iterrows():
+        n_rows = len(df)
+        
+        def column(name, default):
+            # Whole-column access; missing columns fall back to random values
+            if name in df:
+                return df[name].to_numpy(np.float64)
+            return default(n_rows)
+        
+        # Pull every column out of the DataFrame once instead of per row
+        amounts = column('Amount', lambda n: np.random.uniform(10, 5000, n))
+        times = df['Time'] if 'Time' in df else pd.Series(np.arange(n_rows))
+        customer_buckets = pd.util.hash_pandas_object(times, index=False).to_numpy() % 1000
+        merchant_buckets = pd.util.hash_pandas_object(df, index=False).to_numpy() % 100
+        locations = np.random.randint(1, 50, n_rows)
+        devices = np.random.randint(1, 10, n_rows)
+        
+        feature_names = [f"V{i}" for i in range(1, 29)]
+        feature_matrix = np.column_stack([
+            column(name, np.random.randn) for name in feature_names
+        ])
+        
+        for idx in range(n_rows):
             # Create realistic timestamps
             timestamp = base_time + timedelta(seconds=idx * 10)
             
             transaction = Transaction(
                 transaction_id=f"txn_{idx}",
                 timestamp=timestamp,
-                amount=float(row.get('Amount', np.random.uniform(10, 5000))),
-                customer_id=f"cust_{hash(str(row.get('Time', idx))) % 1000}",
-                merchant_id=f"merch_{hash(str(row)) % 100}",
-                location=f"loc_{np.random.randint(1, 50)}",
-                device_id=f"device_{np.random.randint(1, 10)}",
+                amount=float(amounts[idx]),
+                customer_id=f"cust_{customer_buckets[idx]}",
+                merchant_id=f"merch_{merchant_buckets[idx]}",
+                location=f"loc_{locations[idx]}",
+                device_id=f"device_{devices[idx]}",
                 transaction_type="purchase",
-                features={f"V{i}": float(row.get(f"V{i}", np.random.randn())) 
-                         for i in range(1, 29)}
+                features=dict(zip(feature_names, feature_matrix[idx].tolist()))
             )
             yield transaction
     
@@ -320,5 +631,10 @@ class DetectionEngine:
         return pd.DataFrame(data)
 
 if __name__ == "__main__":
+    try:
+        import uvloop  # POSIX only; otherwise keep the default asyncio loop
+        uvloop.install()
+    except ImportError:
+        pass
     engine = DetectionEngine()
     asyncio.run(engine.start())
\ No newline at end of file
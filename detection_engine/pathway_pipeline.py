@@ -2,6 +2,13 @@
 import pathway as pw
 from typing import Dict, Any
 from shared.schemas import Transaction
+from xxhash import xxh3_64_intdigest
+
+@pw.udf
+def location_risk(location: str) -> int:
+    # Stable hash so every worker and restart buckets a location the same way
+    return xxh3_64_intdigest(location.encode()) % 10
+
 
 def build_fraud_pipeline(experts, weight_manager):
     """Build the core Pathway streaming pipeline"""
@@ -24,22 +31,23 @@ def build_fraud_pipeline(experts, weight_manager):
         *pw.this.all(),
         # Velocity features (simplified)
         amount_velocity=pw.this.amount / 1000,
-        location_risk=pw.apply(lambda loc: hash(loc) % 10, pw.this.location)
+        location_risk=location_risk(pw.this.location)
     )
     
-    # Expert predictions (would integrate with actual expert classes)
-    def expert_predictions_wrapper(transaction_data):
-        # This would call the actual expert predict methods
-        # Simplified for prototype
-        return {
-            'xgboost_score': 0.1,
-            'rule_score': 0.2,
-            'streaming_score': 0.15
-        }
-    
+    # Expert predictions as column expressions, evaluated by the engine
+    # without a Python call per row
     predictions = enriched_transactions.select(
         *pw.this.all(),
-        **expert_predictions_wrapper(pw.this)
+        # Same thresholds as XGBoostExpert's mock model
+        xgboost_score=pw.if_else(
+            pw.this.amount > 1000, 0.8,
+            pw.if_else(pw.this.amount > 500, 0.4, 0.1)
+        ),
+        # RuleEngineExpert's high_amount rule; the location and velocity
+        # rules need per-customer history this graph doesn't keep
+        rule_score=pw.if_else(pw.this.amount > 1000, 0.7, 0.0),
+        # Streaming experts hold no state here, so use their prior
+        streaming_score=0.15
     )
     
     # Ensemble combination
@@ -1,48 +1,157 @@
 # detection_engine/weight_manager.py
 import numpy as np
-from collections import deque, defaultdict
+from collections import defaultdict
 from typing import Dict, List
 import math
 import logging
 
+try:
+    from numba import njit, prange
+    _NUMBA_AVAILABLE = True
+except ImportError:  # numba is optional; fall back to the numpy path
+    prange = range
+    _NUMBA_AVAILABLE = False
+
 logger = logging.getLogger(__name__)
 
 
+def _linucb_ucb(A_inv, theta, contexts, alpha):
+    """UCB scores of a (B, d) batch of contexts against one LinUCB arm"""
+    n_rows = contexts.shape[0]
+    scores = np.empty(n_rows)
+    for r in range(n_rows):
+        ctx = contexts[r]
+        scores[r] = theta @ ctx + alpha * math.sqrt(max(ctx @ A_inv @ ctx, 0.0))
+    return scores
+
+
+def _linucb_update(A, A_inv, b, ctx, reward):
+    """
+    Fold one observation into A, A_inv and b in place and return the new theta.
+    
+    A_inv is kept current with a Sherman-Morrison rank-1 update, O(d^2)
+    instead of re-inverting A.
+    """
+    d = ctx.shape[0]
+    Ax = A_inv @ ctx
+    denominator = 1.0 + ctx @ Ax
+    for i in range(d):
+        b[i] += reward * ctx[i]
+        for j in range(d):
+            A[i, j] += ctx[i] * ctx[j]
+            A_inv[i, j] -= Ax[i] * Ax[j] / denominator
+    return A_inv @ b
+
+
+def _linucb_batch_update(A, A_inv, b, theta, contexts, rewards, observed):
+    """
+    Fold a (B, d) batch of observations into stacked (E, d, d) / (E, d) arms.
+    
+    rewards and observed are (B, E); an arm only learns from rows where
+    observed is set. Arms are independent, so they are updated in parallel
+    and each one walks the batch in order with Sherman-Morrison steps.
+    """
+    n_arms = A.shape[0]
+    n_rows = contexts.shape[0]
+    for e in prange(n_arms):
+        for r in range(n_rows):
+            if not observed[r, e]:
+                continue
+            ctx = contexts[r]
+            Ax = A_inv[e] @ ctx
+            A[e] += np.outer(ctx, ctx)
+            A_inv[e] -= np.outer(Ax, Ax) / (1.0 + ctx @ Ax)
+            b[e] += rewards[r, e] * ctx
+        theta[e] = A_inv[e] @ b[e]
+
+
+if _NUMBA_AVAILABLE:
+    _linucb_ucb = njit(cache=True, fastmath=True)(_linucb_ucb)
+    _linucb_update = njit(cache=True, fastmath=True)(_linucb_update)
+    _linucb_batch_update = njit(cache=True, parallel=True)(_linucb_batch_update)
+
+
+def warm_up_linucb_kernels(context_dim: int):
+    """Compile the LinUCB kernels ahead of the first transaction"""
+    if not _NUMBA_AVAILABLE:
+        return
+    A = np.identity(context_dim)
+    A_inv = np.identity(context_dim)
+    b = np.zeros(context_dim)
+    ctx = np.full(context_dim, 0.1)
+    theta = _linucb_update(A, A_inv, b, ctx, 0.0)
+    _linucb_ucb(A_inv, theta, ctx.reshape(1, -1), 0.1)
+    _linucb_batch_update(
+        A[None], A_inv[None], b[None], theta[None],
+        ctx.reshape(1, -1), np.zeros((1, 1)), np.ones((1, 1), dtype=np.bool_)
+    )
+
+
 class ContextualBanditWeightManager:
     def __init__(self, experts: List[str], context_dim: int, alpha: float = 0.1):
         self.experts = experts
         self.context_dim = context_dim
         self.alpha = alpha
         
+        # Every expert's A, A_inv, b and theta live in stacked (E, d, d) /
+        # (E, d) arrays so all experts are scored and updated in one batched
+        # call; each LinUCB updates its own slice in place
+        n_experts = len(experts)
+        self._A_stack = np.tile(np.eye(context_dim), (n_experts, 1, 1))
+        self._A_inv_stack = np.tile(np.eye(context_dim), (n_experts, 1, 1))
+        self._b_stack = np.zeros((n_experts, context_dim))
+        self._theta_stack = np.zeros((n_experts, context_dim))
+        
         # LinUCB for each expert
         self.bandits = {
-            expert: LinUCB(context_dim, alpha) 
-            for expert in experts
+            expert: LinUCB(
+                context_dim, alpha,
+                A=self._A_stack[e], A_inv=self._A_inv_stack[e],
+                b=self._b_stack[e], theta=self._theta_stack[e]
+            )
+            for e, expert in enumerate(experts)
         }
+        self._expert_index = {expert: e for e, expert in enumerate(experts)}
         
         self.performance_tracker = ExpertPerformanceTracker(experts)
         
     def select_experts(self, context: List[float]) -> Dict[str, float]:
         """Select expert weights using contextual bandits"""
-        # Ensure context is correct dimension
-        context_vector = np.array(context)
-        if len(context_vector) != self.context_dim:
-            # Pad or truncate to match dimension
-            if len(context_vector) < self.context_dim:
-                context_vector = np.pad(
-                    context_vector, 
-                    (0, self.context_dim - len(context_vector))
-                )
-            else:
-                context_vector = context_vector[:self.context_dim]
+        return self.select_experts_batch([context])[0]
+    
+    def select_experts_batch(self, contexts) -> List[Dict[str, float]]:
+        """Select expert weights for a (B, context_dim) batch of contexts"""
+        return [
+            dict(zip(self.experts, row))
+            for row in self.select_experts_matrix(contexts).tolist()
+        ]
+    
+    def select_experts_matrix(self, contexts) -> np.ndarray:
+        """(B, E) expert weights, columns in self.experts order"""
+        context_matrix = self._fit_context_dim(contexts)
         
-        # Get UCB scores for each expert
-        ucb_scores = {}
-        for expert, bandit in self.bandits.items():
-            ucb_scores[expert] = bandit.ucb_score(context_vector)
+        # (B, E) UCB scores for all experts at once
+        means = context_matrix @ self._theta_stack.T
+        quad = np.sum((context_matrix @ self._A_inv_stack) * context_matrix, axis=-1).T
+        ucb_scores = means + self.alpha * np.sqrt(np.maximum(quad, 0.0))
         
         # Softmax to get probabilities
-        return self._softmax_normalize(ucb_scores)
+        return self._softmax_normalize_batch(ucb_scores)
+    
+    def _fit_context_dim(self, contexts) -> np.ndarray:
+        """(B, context_dim) float64 matrix of contexts"""
+        # Ensure contexts are correct dimension
+        context_matrix = np.atleast_2d(np.asarray(contexts, dtype=np.float64))
+        n_columns = context_matrix.shape[1]
+        if n_columns < self.context_dim:
+            # Pad or truncate to match dimension
+            context_matrix = np.pad(
+                context_matrix,
+                ((0, 0), (0, self.context_dim - n_columns))
+            )
+        elif n_columns > self.context_dim:
+            context_matrix = context_matrix[:, :self.context_dim]
+        return np.ascontiguousarray(context_matrix)
     
     def update_with_feedback(self, context: List[float], expert_decisions: Dict, 
                            true_label: bool, importance_weight: float = 1.0):
@@ -55,19 +164,30 @@ class ContextualBanditWeightManager:
             true_label: True if transaction was fraud, False if legitimate
             importance_weight: Weight to apply based on feedback delay
         """
-        # Ensure context is correct dimension
-        context_vector = np.array(context)
-        if len(context_vector) != self.context_dim:
-            if len(context_vector) < self.context_dim:
-                context_vector = np.pad(
-                    context_vector, 
-                    (0, self.context_dim - len(context_vector))
-                )
-            else:
-                context_vector = context_vector[:self.context_dim]
+        self.update_with_feedback_batch(
+            [context], [expert_decisions], [true_label], [importance_weight]
+        )
+    
+    def update_with_feedback_batch(self, contexts, expert_decisions: List[Dict],
+                                   true_labels: List[bool],
+                                   importance_weights: List[float] = None):
+        """Update bandits with a batch of feedback events, in order"""
+        context_matrix = self._fit_context_dim(contexts)
+        n_events = len(expert_decisions)
+        if importance_weights is None:
+            importance_weights = [1.0] * n_events
         
-        for expert_name, decision in expert_decisions.items():
-            if expert_name in self.bandits:
+        rewards = np.zeros((n_events, len(self.experts)))
+        observed = np.zeros((n_events, len(self.experts)), dtype=np.bool_)
+        
+        for r, (decisions, true_label, importance_weight) in enumerate(
+            zip(expert_decisions, true_labels, importance_weights)
+        ):
+            for expert_name, decision in decisions.items():
+                e = self._expert_index.get(expert_name)
+                if e is None:
+                    continue
+                
                 # Handle both dict and ExpertDecision objects
                 if isinstance(decision, dict):
                     expert_score = decision.get('score', 0.5)
@@ -76,15 +196,21 @@ class ContextualBanditWeightManager:
                 
                 # Calculate reward based on expert performance
                 reward = self._calculate_reward(expert_score, true_label)
-                weighted_reward = reward * importance_weight
-                
-                # Update bandit
-                self.bandits[expert_name].update(context_vector, weighted_reward)
+                rewards[r, e] = reward * importance_weight
+                observed[r, e] = True
                 
                 # Update performance tracker
                 self.performance_tracker.update(expert_name, reward)
         
-        logger.debug(f"Updated bandits with feedback (weight: {importance_weight:.3f})")
+        # Update all bandits in one call
+        _linucb_batch_update(
+            self._A_stack, self._A_inv_stack, self._b_stack, self._theta_stack,
+            context_matrix, rewards, observed
+        )
+        for expert_name, n_observed in zip(self.experts, observed.sum(axis=0).tolist()):
+            self.bandits[expert_name].n_updates += n_observed
+        
+        logger.debug(f"Updated bandits with {n_events} feedback events")
     
     def _calculate_reward(self, expert_score: float, true_label: bool) -> float:
         """
@@ -104,7 +230,9 @@ class ContextualBanditWeightManager:
         # Add temperature parameter for exploration
         temperature = 1.0
         
-        exp_scores = {k: math.exp(v / temperature) for k, v in scores.items()}
+        # Shift by the max score so exp cannot overflow
+        max_score = max(scores.values())
+        exp_scores = {k: math.exp((v - max_score) / temperature) for k, v in scores.items()}
         total = sum(exp_scores.values())
         
         if total == 0:
@@ -113,6 +241,14 @@ class ContextualBanditWeightManager:
         
         return {k: v / total for k, v in exp_scores.items()}
     
+    def _softmax_normalize_batch(self, scores: np.ndarray) -> np.ndarray:
+        """Row-wise _softmax_normalize over a (B, E) score matrix"""
+        temperature = 1.0
+        
+        # Shift each row by its max score so exp cannot overflow
+        exp_scores = np.exp((scores - scores.max(axis=1, keepdims=True)) / temperature)
+        return exp_scores / exp_scores.sum(axis=1, keepdims=True)
+    
     def get_expert_statistics(self) -> Dict:
         """Get current statistics for all experts"""
         stats = {}
@@ -128,48 +264,61 @@ class ContextualBanditWeightManager:
 
 class LinUCB:
     """Linear Upper Confidence Bound algorithm"""
-    def __init__(self, context_dim: int, alpha: float = 0.1):
+    def __init__(self, context_dim: int, alpha: float = 0.1,
+                 A: np.ndarray = None, A_inv: np.ndarray = None,
+                 b: np.ndarray = None, theta: np.ndarray = None):
+        # A, A_inv, b and theta may be slices of a caller's stacked arrays;
+        # they are only ever written in place
         self.context_dim = context_dim
-        self.A = np.eye(context_dim)  # Context covariance matrix
-        self.b = np.zeros(context_dim)  # Reward vector
+        self.A = np.eye(context_dim) if A is None else A  # Context covariance matrix
+        self._A_inv = np.eye(context_dim) if A_inv is None else A_inv  # Inverse of A, kept current by update
+        self.b = np.zeros(context_dim) if b is None else b  # Reward vector
         self.alpha = alpha
-        self.theta = np.zeros(context_dim)  # Model parameters
+        self.theta = np.zeros(context_dim) if theta is None else theta  # Model parameters
         self.n_updates = 0
     
     def ucb_score(self, context: np.ndarray) -> float:
         """Calculate UCB score for context"""
-        context = context.flatten()
+        return float(self.ucb_scores(context.reshape(1, -1))[0])
+    
+    def ucb_scores(self, contexts: np.ndarray) -> np.ndarray:
+        """Calculate UCB scores for a (B, context_dim) batch of contexts"""
+        contexts = np.ascontiguousarray(contexts, dtype=np.float64)
+        
+        if _NUMBA_AVAILABLE:
+            return _linucb_ucb(self._A_inv, self.theta, contexts, self.alpha)
         
         # Mean prediction
-        mean = self.theta.dot(context)
+        means = contexts @ self.theta
         
         # Confidence bound
-        try:
-            A_inv = np.linalg.inv(self.A)
-            confidence = self.alpha * np.sqrt(
-                context.dot(A_inv).dot(context)
-            )
-        except np.linalg.LinAlgError:
-            # If matrix is singular, use small confidence
-            confidence = self.alpha * 0.1
+        confidence = self.alpha * np.sqrt(np.maximum(
+            np.einsum('bi,ij,bj->b', contexts, self._A_inv, contexts), 0.0
+        ))
         
-        return mean + confidence
+        return means + confidence
     
     def update(self, context: np.ndarray, reward: float):
         """Update model with new observation"""
-        context = context.flatten()
+        context = np.ascontiguousarray(context, dtype=np.float64).flatten()
+        
+        if _NUMBA_AVAILABLE:
+            self.theta[:] = _linucb_update(
+                self.A, self._A_inv, self.b, context, float(reward)
+            )
+            self.n_updates += 1
+            return
         
         # Update matrices
         self.A += np.outer(context, context)
         self.b += reward * context
         
+        # Sherman-Morrison rank-1 update of the cached inverse
+        Ax = self._A_inv @ context
+        self._A_inv -= np.outer(Ax, Ax) / (1.0 + context @ Ax)
+        
         # Update parameters
-        try:
-            self.theta = np.linalg.inv(self.A).dot(self.b)
-        except np.linalg.LinAlgError:
-            # If inversion fails, use regularization
-            regularization = 0.01 * np.eye(self.context_dim)
-            self.theta = np.linalg.inv(self.A + regularization).dot(self.b)
+        self.theta[:] = self._A_inv @ self.b
         
         self.n_updates += 1
     
@@ -181,12 +330,14 @@ class LinUCB:
 
 class ExpertPerformanceTracker:
     """Track expert performance over time"""
-    def __init__(self, experts: List[str], window_size: int = 1000):
+    def __init__(self, experts: List[str], window_size: int = 1000,
+                 recent_window: int = 100):
         self.performance_history = {
-            expert: deque(maxlen=window_size) 
+            expert: RewardWindow(window_size, recent_window)
             for expert in experts
         }
         self.window_size = window_size
+        self.recent_window = recent_window
     
     def update(self, expert: str, reward: float):
         """Record new performance observation"""
@@ -198,27 +349,21 @@ class ExpertPerformanceTracker:
         if expert not in self.performance_history:
             return 0.5  # Neutral prior
         
-        history = list(self.performance_history[expert])
-        if len(history) == 0:
+        history = self.performance_history[expert]
+        if history.count == 0:
             return 0.5  # Neutral prior
         
-        if len(history) < window:
-            recent = history
-        else:
-            recent = history[-window:]
-        
-        return np.mean(recent)
+        return history.recent_mean(window)
     
     def get_all_statistics(self) -> Dict:
         """Get statistics for all experts"""
         stats = {}
-        for expert in self.performance_history.keys():
-            history = list(self.performance_history[expert])
-            if history:
+        for expert, history in self.performance_history.items():
+            if history.count:
                 stats[expert] = {
-                    'mean': np.mean(history),
-                    'std': np.std(history),
-                    'count': len(history),
+                    'mean': history.mean(),
+                    'std': history.std(),
+                    'count': history.count,
                     'recent_mean': self.get_recent_performance(expert, 100)
                 }
             else:
@@ -228,4 +373,71 @@ class ExpertPerformanceTracker:
                     'count': 0,
                     'recent_mean': 0.5
                 }
-        return stats
\ No newline at end of file
+        return stats
+
+
+class RewardWindow:
+    """
+    Fixed-size ring buffer of rewards with running sums.
+    
+    Mean and std over the whole window, and the mean over the last
+    recent_window rewards, are O(1); other windows reduce a slice.
+    """
+    __slots__ = ('size', 'recent_window', 'count', '_buffer', '_head',
+                 '_sum', '_sum_sq', '_recent_sum')
+    
+    def __init__(self, size: int, recent_window: int = 100):
+        self.size = size
+        self.recent_window = min(recent_window, size)
+        self.count = 0
+        self._buffer = np.zeros(size)
+        self._head = 0  # Next slot to write
+        self._sum = 0.0
+        self._sum_sq = 0.0
+        self._recent_sum = 0.0
+    
+    def __len__(self) -> int:
+        return self.count
+    
+    def append(self, reward: float):
+        reward = float(reward)
+        
+        # Reward leaving the recent window, still in the buffer since
+        # recent_window <= size
+        if self.count >= self.recent_window:
+            self._recent_sum -= self._buffer[(self._head - self.recent_window) % self.size]
+        self._recent_sum += reward
+        
+        # Reward being overwritten leaves the full window
+        if self.count == self.size:
+            evicted = self._buffer[self._head]
+            self._sum -= evicted
+            self._sum_sq -= evicted * evicted
+        else:
+            self.count += 1
+        
+        self._buffer[self._head] = reward
+        self._sum += reward
+        self._sum_sq += reward * reward
+        self._head = (self._head + 1) % self.size
+    
+    def mean(self) -> float:
+        return self._sum / self.count
+    
+    def std(self) -> float:
+        mean = self.mean()
+        return math.sqrt(max(self._sum_sq / self.count - mean * mean, 0.0))
+    
+    def recent_mean(self, window: int) -> float:
+        """Mean of the last `window` rewards (all of them if fewer)"""
+        n = min(window, self.count)
+        if n == min(self.recent_window, self.count):
+            return self._recent_sum / n
+        if n == self.count:
+            return self.mean()
+        
+        # Uncommon window size: reduce the last n slots directly
+        start = (self._head - n) % self.size
+        if start + n <= self.size:
+            return float(self._buffer[start:start + n].mean())
+        return float((self._buffer[start:].sum() + self._buffer[:self._head].sum()) / n)
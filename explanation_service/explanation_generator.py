@@ -1,38 +1,77 @@
 # explanation_service/explanation_generator.py
 import google.generativeai as genai
 import os
+from collections import OrderedDict
 from typing import Dict, Any
 import json
 import asyncio
+import orjson
+import xxhash
+from shared.redis_client import redis_client
+
+# Explanations kept in memory; least recently used ones are evicted first
+EXPLANATION_CACHE_SIZE = 10000
+# LLM explanations are also shared between processes through Redis
+EXPLANATION_REDIS_TTL = 86400  # 24 hours
 
 class ExplanationGenerator:
     def __init__(self):
         # Configure Gemini
         genai.configure(api_key=os.getenv('GEMINI_API_KEY'))
         self.model = genai.GenerativeModel('gemini-pro')
-        self.explanation_cache = {}
+        self.explanation_cache = OrderedDict()
+        # Gemini calls in progress, keyed like the cache
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self.cache_stats = {'memory_hits': 0, 'redis_hits': 0, 'misses': 0}
         
     async def generate_explanation(self, alert_data: Dict[str, Any]) -> str:
         """Generate human-readable explanation for alert"""
-        
-        cache_key = self._generate_cache_key(alert_data)
-        if cache_key in self.explanation_cache:
-            return self.explanation_cache[cache_key]
-        
         ensemble_decision = alert_data['ensemble_decision']
         final_score = ensemble_decision['final_score']
         
-        # Use template for simple cases, LLM for complex ones
+        # Use template for simple cases, LLM for complex ones. Templates are
+        # cheap to rebuild, so only LLM output goes through the cache
         if final_score > 0.8 or final_score < 0.2:
-            explanation = self._generate_template_explanation(ensemble_decision)
-        else:
-            explanation = await self._generate_gemini_explanation(ensemble_decision)
+            return self._generate_template_explanation(ensemble_decision)
         
-        self.explanation_cache[cache_key] = explanation
-        return explanation
+        return await self._generate_gemini_explanation(ensemble_decision)
     
     async def _generate_gemini_explanation(self, ensemble_decision: Dict) -> str:
         """Generate detailed explanation using Gemini"""
+        cache_key = self._decision_cache_key(ensemble_decision)
+        cached = self._get_cached(cache_key)
+        if cached is not None:
+            self.cache_stats['memory_hits'] += 1
+            return cached
+        
+        # Concurrent alerts with the same signature share one lookup and
+        # Gemini call
+        task = self._inflight.get(cache_key)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch_or_generate(cache_key, ensemble_decision))
+            self._inflight[cache_key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(cache_key, None))
+        
+        # Shielded so one caller's cancellation doesn't cancel the others
+        return await asyncio.shield(task)
+    
+    async def _fetch_or_generate(self, cache_key: str, ensemble_decision: Dict) -> str:
+        """Explanation from the shared Redis cache, else from Gemini"""
+        try:
+            cached = await redis_client.get(f"expl:{cache_key}")
+        except Exception as e:
+            print(f"Explanation cache lookup failed: {e}")
+            cached = None
+        
+        if cached is not None:
+            self.cache_stats['redis_hits'] += 1
+            self._cache_explanation(cache_key, cached)
+            return cached
+        
+        self.cache_stats['misses'] += 1
+        return await self._call_gemini(cache_key, ensemble_decision)
+    
+    async def _call_gemini(self, cache_key: str, ensemble_decision: Dict) -> str:
         try:
             prompt = self._build_gemini_prompt(ensemble_decision)
             
@@ -42,11 +81,18 @@ class ExplanationGenerator:
                 lambda: self.model.generate_content(prompt)
             )
             
-            return response.text
+            explanation = response.text
             
         except Exception as e:
             print(f"Gemini explanation failed: {e}")
             return self._generate_template_explanation(ensemble_decision)
+        
+        self._cache_explanation(cache_key, explanation)
+        try:
+            await redis_client.setex(f"expl:{cache_key}", EXPLANATION_REDIS_TTL, explanation)
+        except Exception as e:
+            print(f"Explanation cache store failed: {e}")
+        return explanation
     
     def _build_gemini_prompt(self, ensemble_decision: Dict) -> str:
         """Build prompt for Gemini"""
@@ -117,10 +163,29 @@ Write in professional language for financial analysts.
 """
         return explanation.strip()
     
-    def _generate_cache_key(self, alert_data: Dict) -> str:
-        factors = alert_data['ensemble_decision']['primary_factors']
-        factor_strings = [f["description"] for f in factors]
-        return hash(tuple(factor_strings))
+    def _decision_cache_key(self, ensemble_decision: Dict) -> str:
+        # Content hash of the decision's shape, stable across restarts and
+        # workers unlike hash(); 128 bits since keys are shared through Redis
+        return xxhash.xxh3_128_hexdigest(orjson.dumps({
+            's': round(ensemble_decision['final_score'], 2),
+            'e': sorted(
+                (name, round(decision['score'], 2))
+                for name, decision in ensemble_decision['expert_decisions'].items()
+            ),
+            'f': sorted(f["description"] for f in ensemble_decision['primary_factors'])
+        }))
+    
+    def _get_cached(self, cache_key: str):
+        explanation = self.explanation_cache.get(cache_key)
+        if explanation is not None:
+            self.explanation_cache.move_to_end(cache_key)
+        return explanation
+    
+    def _cache_explanation(self, cache_key: str, explanation: str):
+        self.explanation_cache[cache_key] = explanation
+        self.explanation_cache.move_to_end(cache_key)
+        if len(self.explanation_cache) > EXPLANATION_CACHE_SIZE:
+            self.explanation_cache.popitem(last=False)
     
 
 
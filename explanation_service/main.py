@@ -1,12 +1,43 @@
 # explanation_service/main.py
 from fastapi import FastAPI
 import asyncio
-import json
+import numpy as np
+import orjson
+import socket
+from itertools import islice
+from redis.exceptions import ResponseError
 from .explanation_generator import ExplanationGenerator
-from shared.redis_client import redis_client
+from shared.redis_client import (
+    redis_client, store_and_publish, ALERTS_STREAM, ALERTS_GROUP
+)
 from shared.schemas import Alert
 import logging
 
+# Score variance above which experts are considered to disagree
+EXPERT_CONFLICT_VARIANCE = 0.1
+# Below this many experts the variance is computed in plain Python
+NUMPY_VARIANCE_MIN_EXPERTS = 8
+
+# Alerts read from the stream per XREADGROUP call
+ALERT_READ_COUNT = 64
+ALERT_READ_BLOCK_MS = 5000
+
+# Background Redis writes allowed to run at once
+MAX_CONCURRENT_WRITES = 32
+
+# (explanation_type, routing_reason) indexed by
+# (is_high_confidence << 2) | (is_ambiguous << 1) | has_expert_conflict
+_ROUTING_TABLE = (
+    ("template", "Standard case → Template explanation"),             # 000
+    ("llm", "Expert disagreement → LLM for reconciliation"),          # 001
+    ("llm", "Ambiguous score → LLM for nuanced explanation"),         # 010
+    ("llm", "Ambiguous score → LLM for nuanced explanation"),         # 011
+    ("template", "High confidence, clear decision → Fast template"),  # 100
+    ("llm", "Expert disagreement → LLM for reconciliation"),          # 101
+    ("template", "High confidence, clear decision → Fast template"),  # 110
+    ("llm", "Ambiguous score → LLM for nuanced explanation"),         # 111
+)
+
 app = FastAPI(title="SentinelFlow Explanation Service")
 
 class ExplanationOrchestrator:
@@ -31,60 +62,73 @@ class ExplanationOrchestrator:
         # Analyze decision characteristics
         is_high_confidence = final_score > 0.8 or final_score < 0.2
         is_ambiguous = 0.3 <= final_score <= 0.7
-        has_expert_conflict = self._check_expert_conflict(expert_decisions)
+        has_expert_conflict = self._check_expert_conflict(
+            expert_decisions, ensemble_decision.get('score_variance')
+        )
         
-        # Decision logic
-        if is_high_confidence and not has_expert_conflict:
-            # Simple case: use fast template
-            explanation_type = "template"
-            explanation = self.generator._generate_template_explanation(ensemble_decision)
-            
-        elif is_ambiguous or has_expert_conflict:
-            # Complex case: use LLM for nuanced explanation
-            explanation_type = "llm"
+        # Decision logic: high confidence without conflict → fast template,
+        # ambiguity or conflict → LLM, anything else → template
+        explanation_type, routing_reason = _ROUTING_TABLE[
+            self._routing_index(is_high_confidence, is_ambiguous, has_expert_conflict)
+        ]
+        
+        if explanation_type == "llm":
             explanation = await self.generator._generate_gemini_explanation(ensemble_decision)
-            
         else:
-            # Default to template
-            explanation_type = "template"
             explanation = self.generator._generate_template_explanation(ensemble_decision)
         
         # Add metadata about routing decision
         return {
             'explanation': explanation,
             'explanation_type': explanation_type,
-            'routing_reason': self._get_routing_reason(
-                is_high_confidence, 
-                is_ambiguous, 
-                has_expert_conflict
-            )
+            'routing_reason': routing_reason
         }
     
-    def _check_expert_conflict(self, expert_decisions: dict) -> bool:
-        """Check if experts significantly disagree"""
-        scores = [d['score'] for d in expert_decisions.values()]
-        if len(scores) < 2:
+    @staticmethod
+    def _routing_index(is_high_confidence: bool,
+                       is_ambiguous: bool,
+                       has_conflict: bool) -> int:
+        """Pack the three routing flags into an index into _ROUTING_TABLE"""
+        return (is_high_confidence << 2) | (is_ambiguous << 1) | has_conflict
+    
+    def _check_expert_conflict(self, expert_decisions: dict,
+                               score_variance: float = None) -> bool:
+        """
+        Check if experts significantly disagree. Uses the score variance the
+        detection engine attached to the decision when there is one
+        """
+        n = len(expert_decisions)
+        if n < 2:
             return False
         
         # Calculate variance
-        mean_score = sum(scores) / len(scores)
-        variance = sum((s - mean_score) ** 2 for s in scores) / len(scores)
+        if score_variance is not None:
+            variance = score_variance
+        elif n < NUMPY_VARIANCE_MIN_EXPERTS:
+            # One-pass Welford; cheaper than NumPy dispatch for a handful of experts
+            mean_score = 0.0
+            m2 = 0.0
+            for k, decision in enumerate(expert_decisions.values(), 1):
+                delta = decision['score'] - mean_score
+                mean_score += delta / k
+                m2 += delta * (decision['score'] - mean_score)
+            variance = m2 / n
+        else:
+            variance = np.fromiter(
+                (d['score'] for d in expert_decisions.values()),
+                dtype=np.float64, count=n
+            ).var()
         
         # High variance indicates conflict
-        return variance > 0.1
+        return variance > EXPERT_CONFLICT_VARIANCE
     
     def _get_routing_reason(self, is_high_confidence: bool, 
                            is_ambiguous: bool, 
                            has_conflict: bool) -> str:
         """Generate human-readable routing reason"""
-        if is_high_confidence and not has_conflict:
-            return "High confidence, clear decision → Fast template"
-        elif is_ambiguous:
-            return "Ambiguous score → LLM for nuanced explanation"
-        elif has_conflict:
-            return "Expert disagreement → LLM for reconciliation"
-        else:
-            return "Standard case → Template explanation"
+        return _ROUTING_TABLE[
+            self._routing_index(is_high_confidence, is_ambiguous, has_conflict)
+        ][1]
 
 
 # Global instances
@@ -99,24 +143,77 @@ async def startup_event():
 
 
 async def process_alerts():
-    """Continuously process alerts from Redis"""
-    pubsub = redis_client.pubsub()
-    await pubsub.subscribe('alerts')
+    """Continuously process alerts from the Redis alerts stream"""
+    try:
+        await redis_client.xgroup_create(ALERTS_STREAM, ALERTS_GROUP, id='$', mkstream=True)
+    except ResponseError as e:
+        if 'BUSYGROUP' not in str(e):
+            raise
+    
+    # Stable per container, so a restarted service finds its own pending alerts
+    consumer = socket.gethostname()
     
     print("🎯 Explanation Service started - listening for alerts...")
     
-    async for message in pubsub.listen():
-        if message['type'] == 'message':
+    # Start with alerts delivered to this consumer but never acknowledged,
+    # then switch to new ones
+    stream_id = '0'
+    while True:
+        try:
+            response = await redis_client.xreadgroup(
+                ALERTS_GROUP, consumer, {ALERTS_STREAM: stream_id},
+                count=ALERT_READ_COUNT, block=ALERT_READ_BLOCK_MS
+            )
+        except Exception as e:
+            logging.error(f"Error reading alerts: {e}")
+            await asyncio.sleep(1)
+            continue
+        
+        entries = response[0][1] if response else []
+        if stream_id == '0' and not entries:
+            stream_id = '>'
+            continue
+        
+        writes = []
+        for entry_id, fields in entries:
             try:
-                alert_data = json.loads(message['data'])
-                await generate_and_publish_explanation(alert_data)
+                alert_data = orjson.loads(fields['p'])
+                writes.append(await generate_and_publish_explanation(alert_data))
                 
             except Exception as e:
                 logging.error(f"Error processing alert: {e}")
+        
+        # Writes ran in the background while the batch was explained; wait
+        # for them before acknowledging so no alert is lost on a crash
+        await asyncio.gather(*writes)
+        
+        if entries:
+            await redis_client.xack(
+                ALERTS_STREAM, ALERTS_GROUP, *[entry_id for entry_id, _ in entries]
+            )
+
+
+_write_slots = asyncio.Semaphore(MAX_CONCURRENT_WRITES)
+
+
+def _write_in_background(coro) -> asyncio.Task:
+    """Run a Redis write off the alert loop, at most MAX_CONCURRENT_WRITES at once"""
+    async def run():
+        async with _write_slots:
+            try:
+                await coro
+            except Exception as e:
+                logging.error(f"Error publishing explanation: {e}")
+    
+    return asyncio.create_task(run())
 
 
-async def generate_and_publish_explanation(alert_data):
-    """Generate explanation using orchestrator and publish to dashboard"""
+async def generate_and_publish_explanation(alert_data) -> asyncio.Task:
+    """
+    Generate explanation using orchestrator and publish to dashboard.
+    The Redis write runs in the background; the returned task completes
+    once it has finished.
+    """
     try:
         transaction_id = alert_data['transaction']['transaction_id']
         
@@ -128,32 +225,31 @@ async def generate_and_publish_explanation(alert_data):
         alert_data['explanation_type'] = explanation_result['explanation_type']
         alert_data['routing_reason'] = explanation_result['routing_reason']
         
-        # **FIX 2: Store explanation for analytics**
-        await redis_client.setex(
+        # **FIX 2: Store explanation for analytics** and publish to
+        # dashboard atomically in a single round trip
+        write = _write_in_background(store_and_publish(
             f"explanation:{transaction_id}",
             86400,  # 24 hour TTL
-            json.dumps(explanation_result)
-        )
-        
-        # Publish to dashboard
-        await redis_client.publish(
-            'alerts_with_explanations', 
-            json.dumps(alert_data, default=str)
-        )
+            orjson.dumps(explanation_result),
+            'alerts_with_explanations',
+            orjson.dumps(alert_data, default=str)
+        ))
         
         print(f"📝 Generated {explanation_result['explanation_type']} explanation "
               f"for {transaction_id}")
         
+        return write
+        
     except Exception as e:
         logging.error(f"Error generating explanation: {e}")
         
         # Fallback: send alert without explanation
         alert_data['explanation'] = "Explanation generation failed"
         alert_data['explanation_type'] = "error"
-        await redis_client.publish(
+        return _write_in_background(redis_client.publish(
             'alerts_with_explanations',
-            json.dumps(alert_data, default=str)
-        )
+            orjson.dumps(alert_data, default=str)
+        ))
 
 
 @app.get("/health")
@@ -171,10 +267,16 @@ async def get_stats():
     """Get explanation generation statistics"""
     return {
         "cache_size": len(explanation_generator.explanation_cache),
-        "cache_keys": list(explanation_generator.explanation_cache.keys())[:10]
+        **explanation_generator.cache_stats,
+        "cache_keys": list(islice(explanation_generator.explanation_cache, 10))
     }
 
 
 if __name__ == "__main__":
     import uvicorn
+    try:
+        import uvloop  # POSIX only; otherwise keep the default asyncio loop
+        uvloop.install()
+    except ImportError:
+        pass
     uvicorn.run(app, host="0.0.0.0", port=8001)
\ No newline at end of file
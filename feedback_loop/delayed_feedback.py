@@ -4,12 +4,20 @@ from typing import Dict
 from shared.schemas import Feedback, Transaction
 from shared.redis_client import redis_client
 import time
-import json
+import math
+import numpy as np
+import orjson
 from datetime import datetime
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Importance weight decay per hour of feedback delay; adjust based on your
+# fraud domain
+DECAY_RATE = 0.1
+# Floor on the importance weight of very old feedback
+MIN_WEIGHT = 0.1
+
 
 class DelayedFeedbackHandler:
     def __init__(self):
@@ -19,29 +27,34 @@ class DelayedFeedbackHandler:
         """Process feedback with delay handling"""
         try:
             # **FIX 1: Get the original transaction to calculate real delay**
-            transaction_data = await redis_client.get(
-                f"transaction:{feedback.alert_id}"
+            # and the original expert decisions in one round trip
+            transaction_data, decisions_data = await redis_client.mget(
+                f"transaction:{feedback.alert_id}",
+                f"decisions:{feedback.alert_id}"
             )
             
             if not transaction_data:
                 logger.warning(f"⚠️ No transaction found for alert {feedback.alert_id}")
                 return
             
-            transaction = Transaction(**json.loads(transaction_data))
+            if not decisions_data:
+                logger.warning(f"⚠️ No original decisions found for alert {feedback.alert_id}")
+                return
+            
+            # Only the timestamp is needed, so the transaction is not validated
+            # into a model; records stored before ts_unix existed are parsed
+            transaction = orjson.loads(transaction_data)
+            original_decisions = orjson.loads(decisions_data)
+            transaction_ts = transaction.get('ts_unix')
+            if transaction_ts is None:
+                transaction_ts = Transaction.model_validate(transaction).ts_unix
             
             # **FIX 2: Calculate actual delay from transaction timestamp**
             delay_hours = self._calculate_actual_delay(
-                transaction.timestamp,
-                feedback.feedback_timestamp
+                transaction_ts,
+                feedback.ts_unix
             )
             
-            # Get original expert decisions
-            original_decisions = await self._get_original_decisions(feedback.alert_id)
-            
-            if not original_decisions:
-                logger.warning(f"⚠️ No original decisions found for alert {feedback.alert_id}")
-                return
-            
             # **FIX 3: Calculate importance weight based on actual delay**
             importance_weight = self.delay_distribution.calculate_importance_weight(
                 delay_hours
@@ -49,18 +62,18 @@ class DelayedFeedbackHandler:
             
             # **FIX 4: Store feedback with metadata in Redis**
             feedback_metadata = {
-                'feedback': feedback.dict(),
+                'feedback': feedback.model_dump(),
                 'original_decisions': original_decisions,
                 'importance_weight': importance_weight,
                 'delay_hours': delay_hours,
-                'transaction_timestamp': transaction.timestamp.isoformat(),
+                'transaction_timestamp': transaction['timestamp'],
                 'processed_timestamp': datetime.now().isoformat()
             }
             
             await redis_client.setex(
                 f"feedback_metadata:{feedback.alert_id}",
                 86400,  # 24 hour TTL
-                json.dumps(feedback_metadata, default=str)
+                orjson.dumps(feedback_metadata, default=str)
             )
             
             # Update delay distribution
@@ -74,28 +87,11 @@ class DelayedFeedbackHandler:
         except Exception as e:
             logger.error(f"Error processing delayed feedback: {e}")
     
-    async def _get_original_decisions(self, alert_id: str):
-        """Retrieve original expert decisions for an alert"""
+    def _calculate_actual_delay(self, transaction_ts: float, 
+                               feedback_ts: float) -> float:
+        """Calculate feedback delay in hours from two epoch-second timestamps"""
         try:
-            data = await redis_client.get(f"decisions:{alert_id}")
-            if data:
-                return json.loads(data)
-            return None
-        except Exception as e:
-            logger.error(f"Error retrieving decisions: {e}")
-            return None
-    
-    def _calculate_actual_delay(self, transaction_time: datetime, 
-                               feedback_time: datetime) -> float:
-        """Calculate feedback delay in hours"""
-        try:
-            if isinstance(transaction_time, str):
-                transaction_time = datetime.fromisoformat(transaction_time)
-            if isinstance(feedback_time, str):
-                feedback_time = datetime.fromisoformat(feedback_time)
-            
-            delta = feedback_time - transaction_time
-            delay_hours = delta.total_seconds() / 3600
+            delay_hours = (feedback_ts - transaction_ts) / 3600.0
             
             return max(0.0, delay_hours)  # Ensure non-negative
             
@@ -116,16 +112,23 @@ class DelayDistributionEstimator:
     """Estimate delay distribution for importance weighting"""
     
     def __init__(self):
-        self.delays = []
         self.max_history = 10000
+        # Ring buffer of the most recent delays
+        self._buffer = np.empty(self.max_history)
+        self._count = 0
+        self._head = 0  # Next slot to write
+    
+    @property
+    def delays(self) -> np.ndarray:
+        """Recorded delays, oldest overwritten first (not in arrival order)"""
+        return self._buffer[:self._count]
         
     def record_delay(self, delay_hours: float):
         """Record a new delay observation"""
-        self.delays.append(delay_hours)
-        
         # Keep only recent history
-        if len(self.delays) > self.max_history:
-            self.delays = self.delays[-self.max_history:]
+        self._buffer[self._head] = delay_hours
+        self._head = (self._head + 1) % self.max_history
+        self._count = min(self._count + 1, self.max_history)
     
     def calculate_importance_weight(self, delay_hours: float) -> float:
         """
@@ -137,31 +140,36 @@ class DelayDistributionEstimator:
         3. Less relevant for current model
         """
         # Exponential decay: weight = exp(-lambda * delay)
-        decay_rate = 0.1  # Adjust based on your fraud domain
-        weight = 2.718 ** (-decay_rate * delay_hours)
+        weight = math.exp(-DECAY_RATE * delay_hours)
         
         # Ensure minimum weight for very old feedback
-        min_weight = 0.1
-        return max(min_weight, weight)
+        return max(MIN_WEIGHT, weight)
+    
+    def calculate_importance_weights(self, delays_hours: np.ndarray) -> np.ndarray:
+        """Vectorized calculate_importance_weight over an array of delays"""
+        delays_hours = np.asarray(delays_hours, dtype=np.float64)
+        return np.maximum(MIN_WEIGHT, np.exp(-DECAY_RATE * delays_hours))
     
     def get_mean_delay(self) -> float:
         """Get mean delay from recent feedback"""
-        if not self.delays:
+        if not self._count:
             return 0.0
-        return sum(self.delays) / len(self.delays)
+        return float(self.delays.mean())
     
     def get_histogram(self, bins: int = 5) -> Dict:
         """Get delay distribution histogram"""
-        if not self.delays:
+        if not self._count:
             return {}
         
-        max_delay = max(self.delays)
+        delays = self.delays
+        max_delay = float(delays.max())
         bin_size = max_delay / bins if max_delay > 0 else 1
         
-        histogram = {}
-        for delay in self.delays:
-            bin_idx = min(int(delay / bin_size), bins - 1)
-            bin_label = f"{bin_idx * bin_size:.1f}-{(bin_idx + 1) * bin_size:.1f}h"
-            histogram[bin_label] = histogram.get(bin_label, 0) + 1
+        bin_idx = np.minimum((delays / bin_size).astype(np.int64), bins - 1)
+        counts = np.bincount(bin_idx, minlength=bins)
         
-        return histogram
\ No newline at end of file
+        return {
+            f"{i * bin_size:.1f}-{(i + 1) * bin_size:.1f}h": int(count)
+            for i, count in enumerate(counts.tolist())
+            if count
+        }
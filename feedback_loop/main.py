@@ -1,7 +1,7 @@
 # feedback_loop/main.py
 import asyncio
-import json
-from shared.redis_client import redis_client
+from collections import deque
+from shared.redis_client import redis_client, pubsub_client, PUBSUB_POLL_TIMEOUT
 from shared.schemas import Feedback
 from .delayed_feedback import DelayedFeedbackHandler
 from .online_learning import OnlineLearningManager
@@ -10,13 +10,22 @@ import logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Delayed-feedback handlers allowed to run at once
+MAX_CONCURRENT_FEEDBACK = 32
+
 
 class FeedbackLoop:
     def __init__(self):
         self.feedback_handler = DelayedFeedbackHandler()
         self.learning_manager = OnlineLearningManager()
-        self.feedback_buffer = []
         self.buffer_size = 10
+        # Bounded so a stalled batch update cannot grow it forever; the
+        # oldest feedback is dropped first
+        self.feedback_buffer = deque(maxlen=self.buffer_size * 4)
+        
+        # Delayed-feedback processing runs off the receive loop
+        self._feedback_slots = asyncio.Semaphore(MAX_CONCURRENT_FEEDBACK)
+        self._pending_feedback = set()
     
     async def start(self):
         """Start all feedback loop tasks"""
@@ -29,50 +38,70 @@ class FeedbackLoop:
     
     async def process_feedback_stream(self):
         """Main loop for processing feedback"""
-        pubsub = redis_client.pubsub()
+        pubsub = pubsub_client.pubsub()
         await pubsub.subscribe('feedback')
         
         logger.info("👂 Feedback Loop listening for analyst feedback...")
         
-        async for message in pubsub.listen():
-            if message['type'] == 'message':
-                try:
-                    feedback_data = json.loads(message['data'])
-                    feedback = Feedback(**feedback_data)
-                    
-                    # Add to buffer
-                    self.feedback_buffer.append(feedback)
-                    
-                    # **FIX 1: Process delayed feedback with proper timing**
-                    await self.feedback_handler.process_feedback(feedback)
-                    
-                    # **FIX 2: Trigger batch update if buffer is full**
-                    if len(self.feedback_buffer) >= self.buffer_size:
-                        await self.process_batch()
-                    
-                    logger.info(f"📊 Processed feedback for alert {feedback.alert_id}")
-                    
-                except Exception as e:
-                    logger.error(f"Error processing feedback: {e}")
+        while True:
+            message = await pubsub.get_message(
+                ignore_subscribe_messages=True, timeout=PUBSUB_POLL_TIMEOUT
+            )
+            if message is None:
+                continue
+            try:
+                # Decode and validate in one pass in pydantic-core
+                feedback = Feedback.model_validate_json(message['data'])
+                
+                # Add to buffer
+                self.feedback_buffer.append(feedback)
+                
+                # **FIX 1: Process delayed feedback with proper timing**
+                self._process_feedback_in_background(feedback)
+                
+                # **FIX 2: Trigger batch update if buffer is full**
+                if len(self.feedback_buffer) >= self.buffer_size:
+                    await self.process_batch()
+                
+                logger.info(f"📊 Processed feedback for alert {feedback.alert_id}")
+                
+            except Exception as e:
+                logger.error(f"Error processing feedback: {e}")
+
+    def _process_feedback_in_background(self, feedback: Feedback):
+        async def run():
+            async with self._feedback_slots:
+                await self.feedback_handler.process_feedback(feedback)
+        
+        task = asyncio.create_task(run())
+        self._pending_feedback.add(task)
+        task.add_done_callback(self._pending_feedback.discard)
     
     async def process_batch(self):
         """Process accumulated feedback as a batch"""
         if not self.feedback_buffer:
             return
         
-        logger.info(f"🔄 Processing batch of {len(self.feedback_buffer)} feedback items")
+        # Take the batch now; feedback arriving while it is processed waits
+        # for the next one
+        batch = list(self.feedback_buffer)
+        self.feedback_buffer.clear()
+        
+        # Online learning reads the metadata the delayed-feedback handler
+        # stores, so let in-flight handlers finish first
+        if self._pending_feedback:
+            await asyncio.gather(*self._pending_feedback)
+        
+        logger.info(f"🔄 Processing batch of {len(batch)} feedback items")
         
         try:
             # Update online learning models
-            for feedback in self.feedback_buffer:
+            for feedback in batch:
                 await self.learning_manager.update_models(feedback)
             
             # Trigger batch weight update
             await self.learning_manager._process_batch_update()
             
-            # Clear buffer
-            self.feedback_buffer = []
-            
         except Exception as e:
             logger.error(f"Error processing batch: {e}")
     
@@ -87,5 +116,10 @@ class FeedbackLoop:
 
 
 if __name__ == "__main__":
+    try:
+        import uvloop  # POSIX only; otherwise keep the default asyncio loop
+        uvloop.install()
+    except ImportError:
+        pass
     feedback_loop = FeedbackLoop()
     asyncio.run(feedback_loop.start())
\ No newline at end of file
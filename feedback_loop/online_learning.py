@@ -1,29 +1,49 @@
 # feedback_loop/online_learning.py
 from shared.schemas import Feedback
-from shared.redis_client import redis_client
-import json
+from shared.redis_client import (
+    redis_client, WEIGHT_UPDATES_STREAM, WEIGHT_UPDATES_STREAM_MAXLEN
+)
+import orjson
 import asyncio
+import numpy as np
+from collections import deque
 from typing import Dict, List
 import logging
 from datetime import datetime
+from xxhash import xxh3_128_digest
 
 logger = logging.getLogger(__name__)
 
+# Weight updates whose largest per-expert change is below this are not sent
+WEIGHT_UPDATE_MIN_DELTA = 1e-4
+STATS_KEY = 'online_learning_stats'
+STATS_TTL = 3600  # 1 hour
+
 
 class OnlineLearningManager:
     def __init__(self):
         self.learning_rate = 0.1
         self.batch_size = 10
-        self.pending_updates = []
+        # Bounded so a stalled Redis cannot grow it forever; the oldest
+        # feedback is dropped first
+        self.pending_updates = deque(maxlen=self.batch_size * 4)
+        self.dropped_updates = 0
         
         # Performance tracking per expert
         self.expert_stats = {}
+        
+        # What was last sent to Redis, so unchanged state is not re-sent
+        self._published_weights = {}
+        self._last_stats_hash = None
     
     async def update_models(self, feedback: Feedback):
         """Update online learning models with feedback"""
         logger.info(f"🔄 Online learning: Queuing feedback for {feedback.alert_id}")
         
         # Add to pending updates
+        if len(self.pending_updates) == self.pending_updates.maxlen:
+            self.dropped_updates += 1
+            logger.warning(f"⚠️ Pending updates full, dropping oldest ({self.dropped_updates} dropped)")
         self.pending_updates.append(feedback)
         
         # Process batch if we have enough samples
@@ -35,78 +55,150 @@ class OnlineLearningManager:
         if not self.pending_updates:
             return
         
-        logger.info(f"🔄 Processing batch of {len(self.pending_updates)} feedback samples")
+        # Take the batch before awaiting Redis; feedback queued meanwhile
+        # waits for the next cycle
+        batch = list(self.pending_updates)
+        self.pending_updates.clear()
+        
+        logger.info(f"🔄 Processing batch of {len(batch)} feedback samples")
         
         try:
-            # **FIX 1: Aggregate performance metrics with importance weighting**
-            expert_performance = {}
+            # Get feedback metadata (includes importance weight) for the
+            # whole batch in one round trip
+            all_metadata = await self._get_feedback_metadata_batch(
+                [feedback.alert_id for feedback in batch]
+            )
             
-            for feedback in self.pending_updates:
-                # Get feedback metadata (includes importance weight)
-                metadata = await self._get_feedback_metadata(feedback.alert_id)
-                
-                if not metadata:
-                    logger.warning(f"No metadata for {feedback.alert_id}")
-                    continue
-                
-                original_decisions = metadata.get('original_decisions', {})
-                importance_weight = metadata.get('importance_weight', 1.0)
-                
-                # Evaluate each expert's performance
-                for expert_name, decision in original_decisions.items():
-                    if expert_name not in expert_performance:
-                        expert_performance[expert_name] = {
-                            'correct': 0.0,
-                            'total': 0.0,
-                            'weighted_correct': 0.0,
-                            'weighted_total': 0.0,
-                            'scores': []
-                        }
-                    
-                    # Check if expert was correct
-                    expert_predicted_fraud = decision['score'] > 0.5
-                    was_correct = expert_predicted_fraud == feedback.correct_label
-                    
-                    # **FIX 2: Apply importance weighting**
-                    expert_performance[expert_name]['total'] += 1
-                    expert_performance[expert_name]['weighted_total'] += importance_weight
-                    
-                    if was_correct:
-                        expert_performance[expert_name]['correct'] += 1
-                        expert_performance[expert_name]['weighted_correct'] += importance_weight
-                    
-                    expert_performance[expert_name]['scores'].append({
-                        'score': decision['score'],
-                        'correct': was_correct,
-                        'weight': importance_weight
-                    })
+            # **FIX 1: Aggregate performance metrics with importance weighting**
+            expert_performance = self._aggregate_performance(batch, all_metadata)
             
             # **FIX 3: Calculate weighted accuracy and publish updates**
             if expert_performance:
-                await self._update_expert_weights(expert_performance)
-                await self._persist_statistics(expert_performance)
-            
-            # Clear processed batch
-            self.pending_updates = []
+                # Weight updates and statistics go out in one round trip
+                async with redis_client.pipeline(transaction=False) as pipe:
+                    expert_stats, published_weights = self._update_expert_weights(
+                        expert_performance, pipe
+                    )
+                    stats_hash = self._persist_statistics(
+                        expert_performance, expert_stats, pipe
+                    )
+                    await pipe.execute()
+                
+                # Only commit the new state once it has landed, so a retried
+                # batch is not folded into the moving average twice
+                self.expert_stats = expert_stats
+                if published_weights is not None:
+                    self._published_weights = published_weights
+                if stats_hash is not None:
+                    self._last_stats_hash = stats_hash
             
         except Exception as e:
             logger.error(f"Error processing batch update: {e}")
+            # Retry with the next cycle, still dropping the oldest beyond the cap
+            self.pending_updates = deque(
+                batch + list(self.pending_updates), maxlen=self.pending_updates.maxlen
+            )
+        
+        logger.info(f"📊 Pending updates after batch: {len(self.pending_updates)}")
+    
+    def _aggregate_performance(self, batch: List[Feedback], all_metadata: List) -> Dict:
+        """
+        Per-expert correct/total counts, plain and importance weighted, for a
+        batch of feedback. Computed on (feedback, expert) arrays; the dicts
+        are only built for the output
+        """
+        rows = []
+        for feedback, metadata in zip(batch, all_metadata):
+            if not metadata:
+                logger.warning(f"No metadata for {feedback.alert_id}")
+                continue
+            rows.append((
+                feedback.correct_label,
+                metadata.get('importance_weight', 1.0),
+                metadata.get('original_decisions', {})
+            ))
+        
+        if not rows:
+            return {}
+        
+        expert_names = sorted({name for _, _, decisions in rows for name in decisions})
+        column = {name: j for j, name in enumerate(expert_names)}
+        
+        n = len(rows)
+        scores = np.zeros((n, len(expert_names)))
+        present = np.zeros((n, len(expert_names)), dtype=bool)
+        weights = np.empty(n)
+        labels = np.empty(n, dtype=bool)
+        for i, (label, weight, decisions) in enumerate(rows):
+            labels[i] = label
+            weights[i] = weight
+            for name, decision in decisions.items():
+                scores[i, column[name]] = decision['score']
+                present[i, column[name]] = True
+        
+        # Check if each expert was correct (fraud predicted above 0.5)
+        correct = ((scores > 0.5) == labels[:, None]) & present
+        
+        # **FIX 2: Apply importance weighting**
+        total = present.sum(axis=0)
+        correct_count = correct.sum(axis=0)
+        weighted_total = (present * weights[:, None]).sum(axis=0)
+        weighted_correct = (correct * weights[:, None]).sum(axis=0)
+        
+        expert_performance = {}
+        for j, name in enumerate(expert_names):
+            mask = present[:, j]
+            expert_performance[name] = {
+                'correct': float(correct_count[j]),
+                'total': float(total[j]),
+                'weighted_correct': float(weighted_correct[j]),
+                'weighted_total': float(weighted_total[j]),
+                # Per-sample scores as columns
+                'scores': {
+                    'score': scores[mask, j],
+                    'correct': correct[mask, j].astype(np.uint8),
+                    'weight': weights[mask]
+                }
+            }
+        return expert_performance
     
     async def _get_feedback_metadata(self, alert_id: str):
         """Retrieve feedback metadata from Redis"""
         try:
             data = await redis_client.get(f"feedback_metadata:{alert_id}")
             if data:
-                return json.loads(data)
+                return orjson.loads(data)
         except Exception as e:
             logger.error(f"Error getting feedback metadata: {e}")
         return None
     
-    async def _update_expert_weights(self, performance: Dict):
+    async def _get_feedback_metadata_batch(self, alert_ids: List[str]) -> List:
+        """Retrieve feedback metadata for many alerts with one MGET"""
+        try:
+            raw = await redis_client.mget(
+                [f"feedback_metadata:{alert_id}" for alert_id in alert_ids]
+            )
+        except Exception as e:
+            logger.error(f"Error getting feedback metadata: {e}")
+            return [None] * len(alert_ids)
+        
+        all_metadata = []
+        for alert_id, data in zip(alert_ids, raw):
+            try:
+                all_metadata.append(orjson.loads(data) if data else None)
+            except Exception as e:
+                logger.error(f"Error decoding feedback metadata for {alert_id}: {e}")
+                all_metadata.append(None)
+        return all_metadata
+    
+    def _update_expert_weights(self, performance: Dict, pipe):
         """
         Update expert weights based on weighted performance
-        Publishes to 'weight_updates' channel for detection engine
+        Queues an XADD to the weight updates stream for detection engine
+        on the given pipeline. Returns the updated expert stats and the
+        weights sent (None if unchanged) without applying either
         """
+        expert_stats = dict(self.expert_stats)
         weights_update = {}
         
         for expert_name, stats in performance.items():
@@ -117,8 +209,8 @@ class OnlineLearningManager:
                 weighted_accuracy = stats['weighted_correct'] / weighted_total
                 
                 # **FIX 4: Exponential moving average for stability**
-                if expert_name in self.expert_stats:
-                    old_accuracy = self.expert_stats[expert_name].get('accuracy', 0.5)
+                if expert_name in expert_stats:
+                    old_accuracy = expert_stats[expert_name].get('accuracy', 0.5)
                     # Smooth update: new = alpha * new + (1-alpha) * old
                     weighted_accuracy = (
                         self.learning_rate * weighted_accuracy + 
@@ -128,7 +220,7 @@ class OnlineLearningManager:
                 weights_update[expert_name] = weighted_accuracy
                 
                 # Update internal stats
-                self.expert_stats[expert_name] = {
+                expert_stats[expert_name] = {
                     'accuracy': weighted_accuracy,
                     'total_samples': stats['total'],
                     'weighted_samples': weighted_total,
@@ -136,38 +228,72 @@ class OnlineLearningManager:
                 }
         
         # **FIX 5: Publish weight updates to detection engine**
-        if weights_update:
-            await redis_client.publish(
-                'weight_updates',
-                json.dumps(weights_update)
-            )
-            logger.info(f"📊 Published weight updates: {weights_update}")
+        if not weights_update or not self._weights_changed(weights_update):
+            return expert_stats, None
+        
+        pipe.xadd(
+            WEIGHT_UPDATES_STREAM,
+            {'w': orjson.dumps(weights_update)},
+            maxlen=WEIGHT_UPDATES_STREAM_MAXLEN,
+            approximate=True
+        )
+        logger.info(f"📊 Publishing weight updates: {weights_update}")
+        return expert_stats, weights_update
+    
+    def _weights_changed(self, weights_update: Dict) -> bool:
+        """True if any expert's weight moved by WEIGHT_UPDATE_MIN_DELTA or more"""
+        if weights_update.keys() != self._published_weights.keys():
+            return True
+        return any(
+            abs(weight - self._published_weights[name]) >= WEIGHT_UPDATE_MIN_DELTA
+            for name, weight in weights_update.items()
+        )
     
-    async def _persist_statistics(self, performance: Dict):
-        """Persist expert performance statistics to Redis"""
+    def _persist_statistics(self, performance: Dict, expert_stats: Dict, pipe):
+        """
+        Queue persisting expert performance statistics on the given pipeline
+        Returns the content hash of what was queued, or None if nothing new was
+        """
         try:
+            # Fingerprint the content without the wall-clock timestamps, which
+            # differ on every batch
+            accuracy = {
+                name: (stats['accuracy'], stats['total_samples'], stats['weighted_samples'])
+                for name, stats in expert_stats.items()
+            }
+            content_hash = xxh3_128_digest(
+                orjson.dumps([performance, accuracy], option=orjson.OPT_SERIALIZE_NUMPY)
+            )
+            if content_hash == self._last_stats_hash:
+                # Unchanged; just keep the stored copy alive
+                pipe.expire(STATS_KEY, STATS_TTL)
+                return None
+            
             stats_data = {
                 'timestamp': datetime.now().isoformat(),
                 'performance': performance,
-                'expert_stats': self.expert_stats
+                'expert_stats': expert_stats
             }
             
-            await redis_client.setex(
-                'online_learning_stats',
-                3600,  # 1 hour TTL
-                json.dumps(stats_data, default=str)
+            pipe.setex(
+                STATS_KEY,
+                STATS_TTL,
+                orjson.dumps(stats_data, option=orjson.OPT_SERIALIZE_NUMPY, default=str)
             )
             
-            logger.info("💾 Persisted online learning statistics")
+            logger.info("💾 Persisting online learning statistics")
+            return content_hash
             
         except Exception as e:
             logger.error(f"Error persisting statistics: {e}")
+            return None
     
     async def get_expert_statistics(self) -> Dict:
         """Get current expert performance statistics"""
         return {
             'expert_stats': self.expert_stats,
             'pending_updates': len(self.pending_updates),
+            'dropped_updates': self.dropped_updates,
             'batch_size': self.batch_size,
             'learning_rate': self.learning_rate
         }
\ No newline at end of file
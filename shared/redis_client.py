@@ -2,8 +2,66 @@
 import redis.asyncio as redis
 import os
 
-# Global Redis client
-redis_client = redis.Redis.from_url(
-    os.getenv('REDIS_URL', 'redis://localhost:6379'),
-    decode_responses=True
-)
\ No newline at end of file
+REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379')
+
+# Shared connection pools. Services import redis_client / pubsub_client
+# and reuse them; never build a client with Redis.from_url per request.
+# Long-lived pub/sub connections sit idle between messages, so keepalive
+# plus a periodic PING catch dead sockets early
+REDIS_MAX_CONNECTIONS = 128
+PUBSUB_MAX_CONNECTIONS = 8
+
+_POOL_OPTIONS = dict(
+    decode_responses=True,
+    socket_keepalive=True,
+    health_check_interval=30
+)
+
+pool = redis.ConnectionPool.from_url(
+    REDIS_URL, max_connections=REDIS_MAX_CONNECTIONS, **_POOL_OPTIONS
+)
+pubsub_pool = redis.ConnectionPool.from_url(
+    REDIS_URL, max_connections=PUBSUB_MAX_CONNECTIONS, **_POOL_OPTIONS
+)
+
+# Commands, pipelines and scripts
+redis_client = redis.Redis(connection_pool=pool)
+
+# Subscribers; each pubsub() holds its connection for as long as it
+# listens, so these come from their own pool and never starve commands
+pubsub_client = redis.Redis(connection_pool=pubsub_pool)
+
+# Seconds a pub/sub reader waits in get_message() before polling again
+PUBSUB_POLL_TIMEOUT = 1.0
+
+# Detection alerts travel over a stream rather than pub/sub so a slow or
+# restarting explanation service picks up where it left off. Each entry
+# holds the JSON alert under the 'p' field
+ALERTS_STREAM = 'alerts_stream'
+ALERTS_STREAM_MAXLEN = 100000  # Approximate trim length
+ALERTS_GROUP = 'explanation_service'
+
+# Bandit weight updates from the feedback loop, same treatment: a detection
+# engine that was down replays what it missed. Entries hold the JSON
+# {expert: score} map under the 'w' field
+WEIGHT_UPDATES_STREAM = 'weight_updates'
+WEIGHT_UPDATES_STREAM_MAXLEN = 10000  # Approximate trim length
+WEIGHT_UPDATES_GROUP = 'detection_engine'
+
+# SETEX + PUBLISH as one atomic command; channels are not keys, so the
+# channel is passed in ARGV
+_STORE_AND_PUBLISH_LUA = """
+redis.call('SETEX', KEYS[1], ARGV[1], ARGV[2])
+return redis.call('PUBLISH', ARGV[3], ARGV[4])
+"""
+_store_and_publish = redis_client.register_script(_STORE_AND_PUBLISH_LUA)
+
+
+async def store_and_publish(key: str, ttl: int, value, channel: str, message):
+    """
+    Store value under key with a TTL and publish message to channel in a
+    single round trip. Runs via EVALSHA; redis-py reloads the script and
+    retries if the server answers NOSCRIPT.
+    """
+    return await _store_and_publish(keys=[key], args=[ttl, value, channel, message])
+
@@ -1,8 +1,18 @@
 # shared/schemas.py
-from pydantic import BaseModel
+from pydantic import BaseModel, computed_field
 from typing import Dict, List, Optional, Any
-from datetime import datetime
+from datetime import datetime, timezone
 from enum import Enum
+from functools import cached_property
+from xxhash import xxh3_64_intdigest
+import numpy as np
+
+def _unix_seconds(value: datetime) -> float:
+    """Epoch seconds; naive datetimes are read as UTC so the result does not
+    depend on the host timezone"""
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
 
 class Transaction(BaseModel):
     transaction_id: str
@@ -14,7 +24,42 @@ class Transaction(BaseModel):
     device_id: str
     transaction_type: str
     features: Dict[str, float]
+    
+    # Serialized with the transaction so readers of the stored JSON get the
+    # timestamp as a float without parsing it
+    @computed_field
+    @cached_property
+    def ts_unix(self) -> float:
+        return _unix_seconds(self.timestamp)
+    
+    @cached_property
+    def feature_vec(self) -> np.ndarray:
+        """Read-only float32 view of features, in dict insertion order"""
+        vec = np.fromiter(self.features.values(), dtype=np.float32, count=len(self.features))
+        vec.flags.writeable = False
+        return vec
+    
+    # Stable 64-bit hashes of the categorical fields, computed once per
+    # transaction and shared by every expert
+    @cached_property
+    def customer_hash(self) -> int:
+        return xxh3_64_intdigest(self.customer_id.encode())
+    
+    @cached_property
+    def merchant_hash(self) -> int:
+        return xxh3_64_intdigest(self.merchant_id.encode())
+    
+    @cached_property
+    def location_hash(self) -> int:
+        return xxh3_64_intdigest(self.location.encode())
+    
+    @cached_property
+    def device_hash(self) -> int:
+        return xxh3_64_intdigest(self.device_id.encode())
 
+# TODO: experts are the only constructors of ExpertDecision and build it with
+# model_construct; consider a @dataclass(slots=True) to drop the per-instance
+# __dict__ once nothing depends on the pydantic API
 class ExpertDecision(BaseModel):
     expert_name: str
     score: float
@@ -29,6 +74,9 @@ class EnsembleDecision(BaseModel):
     weights: Dict[str, float]
     primary_factors: List[Dict[str, Any]]
     needs_human_review: bool
+    # Population variance of the expert scores, filled in by the detection
+    # engine so consumers need not recompute it
+    score_variance: Optional[float] = None
 
 class Alert(BaseModel):
     alert_id: str
@@ -42,4 +90,8 @@ class Feedback(BaseModel):
     alert_id: str
     correct_label: bool  # True if fraud, False if legitimate
     analyst_notes: Optional[str]
-    feedback_timestamp: datetime
\ No newline at end of file
+    feedback_timestamp: datetime
+    
+    @cached_property
+    def ts_unix(self) -> float:
+        return _unix_seconds(self.feedback_timestamp)
@@ -77,7 +77,7 @@ sleep 2
 # Run integration tests
 echo -e "\n${YELLOW}[6/6]${NC} Running integration tests..."
 sleep 5  # Give services time to initialize
-python tests/integration_test.py
+python -m pytest tests/integration_test.py -s
 
 echo -e "\n=========================================="
 echo -e "${GREEN}✓ All services started successfully!${NC}"
@@ -1,96 +1,198 @@
 # tests/integration_test.py
 """
 Integration test to verify all services communicate correctly
+
+Run with `python -m pytest tests/integration_test.py` against a live Redis;
+the tests are skipped when Redis is not reachable
 """
 import asyncio
-import json
+import orjson
 import pytest
+import pytest_asyncio
 from datetime import datetime
-from shared.redis_client import redis_client
+from redis.exceptions import ConnectionError as RedisConnectionError
+from shared.redis_client import (
+    pubsub_client, redis_client as shared_redis_client, ALERTS_STREAM, WEIGHT_UPDATES_STREAM
+)
 from shared.schemas import Transaction, Feedback
 
-class IntegrationTest:
-    """Test complete workflow from transaction to feedback"""
+# Feature vector of the workflow test transaction
+_V_KEYS = tuple(f"V{i}" for i in range(1, 29))
+_V_VALS = tuple(i * 0.1 for i in range(1, 29))
+
+# Expert decisions stored for the workflow test transaction
+_MOCK_DECISIONS = {
+    'xgboost': {
+        'score': 0.75,
+        'confidence': 0.85,
+        'contributing_factors': []
+    },
+    'rule_engine': {
+        'score': 0.82,
+        'confidence': 1.0,
+        'contributing_factors': []
+    }
+}
+_MOCK_DECISIONS_JSON = orjson.dumps(_MOCK_DECISIONS)
+
+# SETEX every key in KEYS with the TTL in ARGV[1] and the value in
+# ARGV[i + 1], in one server-side call
+_SETEX_MANY_LUA = """
+local ttl = tonumber(ARGV[1])
+for i = 1, #KEYS do
+    redis.call('SETEX', KEYS[i], ttl, ARGV[i + 1])
+end
+return #KEYS
+"""
+_setex_many = shared_redis_client.register_script(_SETEX_MANY_LUA)
+
+# How long to wait for services to react before giving up
+WAIT_TIMEOUT = 2.0
+
+# Pooled connections opened before the first test, per pool. Besides the
+# fixture's own connection, the tests hold at most one pipeline and one
+# subscriber at a time
+WARM_CONNECTIONS = 2
+
+
+async def _wait_for_key(client, key: str, timeout: float = WAIT_TIMEOUT):
+    """Poll key with exponential backoff until it exists or timeout passes"""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    delay = 0.02
+    while True:
+        value = await client.get(key)
+        remaining = deadline - loop.time()
+        if value is not None or remaining <= 0:
+            return value
+        await asyncio.sleep(min(delay, remaining))
+        delay *= 2
+
+
+async def _wait_for_message(pubsub, expected, timeout: float = WAIT_TIMEOUT):
+    """
+    Next published message on pubsub whose data is in expected, or None after
+    timeout. Other publishers may share the channel, so anything else is
+    skipped
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while (remaining := deadline - loop.time()) > 0:
+        message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=remaining)
+        if message is not None and message['data'] in expected:
+            return message
+    return None
+
+
+@pytest.fixture(scope='session')
+def event_loop():
+    """One loop for the session, so the pooled connections outlive a test"""
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+
+@pytest_asyncio.fixture(scope='session')
+async def redis_client():
+    """
+    One connection from the shared pool, reused by every test in the
+    session (each xdist worker gets its own); pub/sub still gets its own
+    """
+    conn = shared_redis_client.client()
+    try:
+        # Skip rather than fail when there is no Redis to test against
+        await conn.ping()
+    except (RedisConnectionError, OSError) as e:
+        await conn.aclose()
+        pytest.skip(f"Redis not reachable: {e}")
     
-    async def test_complete_workflow(self):
-        """Test: Transaction → Detection → Explanation → Dashboard → Feedback"""
-        
-        print("\n" + "="*70)
-        print("🧪 INTEGRATION TEST: Complete Workflow")
-        print("="*70)
-        
-        # Step 1: Simulate transaction
-        test_transaction = Transaction(
-            transaction_id="test_txn_001",
-            timestamp=datetime.now(),
-            amount=1500.00,
-            customer_id="cust_123",
-            merchant_id="merch_456",
-            location="loc_789",
-            device_id="device_001",
-            transaction_type="purchase",
-            features={f"V{i}": float(i * 0.1) for i in range(1, 29)}
-        )
-        
-        print(f"\n✅ Step 1: Created test transaction {test_transaction.transaction_id}")
-        
-        # Step 2: Verify detection engine stores data
-        await redis_client.setex(
-            f"transaction:{test_transaction.transaction_id}",
-            86400,
-            json.dumps(test_transaction.dict(), default=str)
-        )
-        
-        stored = await redis_client.get(f"transaction:{test_transaction.transaction_id}")
-        assert stored is not None, "Transaction not stored in Redis"
-        print(f"✅ Step 2: Transaction stored in Redis")
-        
-        # Step 3: Simulate expert decisions
-        mock_decisions = {
-            'xgboost': {
-                'score': 0.75,
-                'confidence': 0.85,
-                'contributing_factors': []
-            },
-            'rule_engine': {
-                'score': 0.82,
-                'confidence': 1.0,
-                'contributing_factors': []
-            }
-        }
-        
-        await redis_client.setex(
-            f"decisions:{test_transaction.transaction_id}",
-            86400,
-            json.dumps(mock_decisions)
-        )
-        print(f"✅ Step 3: Expert decisions stored")
-        
-        # Step 4: Test feedback submission
-        test_feedback = Feedback(
-            alert_id=test_transaction.transaction_id,
-            correct_label=True,  # Was actually fraud
-            analyst_notes="High-risk merchant pattern detected",
-            feedback_timestamp=datetime.now()
-        )
-        
-        # Publish feedback
-        await redis_client.publish(
-            'feedback',
-            json.dumps(test_feedback.dict(), default=str)
-        )
-        print(f"✅ Step 4: Feedback published to Redis")
-        
-        # Step 5: Verify feedback can be retrieved
-        await asyncio.sleep(0.5)  # Give time for processing
-        
-        metadata = await redis_client.get(
-            f"feedback_metadata:{test_transaction.transaction_id}"
+    # Concurrent PINGs each check out their own connection, so the pools
+    # hold open sockets before any test runs and no test pays for the
+    # TCP handshake or AUTH
+    await asyncio.gather(*(
+        client.ping()
+        for client in (shared_redis_client, pubsub_client)
+        for _ in range(WARM_CONNECTIONS)
+    ))
+    
+    yield conn
+    await conn.aclose()
+
+
+@pytest.mark.asyncio
+async def test_complete_workflow(redis_client):
+    """Test: Transaction → Detection → Explanation → Dashboard → Feedback"""
+    
+    # One clock reading for every timestamp in the test
+    now = datetime.now()
+    now_iso = now.isoformat()
+    
+    # Step 1: Simulate transaction. The fixtures are literals of the right
+    # types, so the models are built without validation
+    test_transaction = Transaction.model_construct(
+        transaction_id="test_txn_001",
+        timestamp=now,
+        amount=1500.00,
+        customer_id="cust_123",
+        merchant_id="merch_456",
+        location="loc_789",
+        device_id="device_001",
+        transaction_type="purchase",
+        features=dict(zip(_V_KEYS, _V_VALS))
+    )
+    
+    print(f"\n✅ Step 1: Created test transaction {test_transaction.transaction_id}")
+    
+    transaction_id = test_transaction.transaction_id
+    transaction_key = f"transaction:{transaction_id}"
+    decisions_key = f"decisions:{transaction_id}"
+    metadata_key = f"feedback_metadata:{transaction_id}"
+    transaction_json = orjson.dumps(test_transaction.model_dump())
+    
+    test_feedback = Feedback.model_construct(
+        alert_id=transaction_id,
+        correct_label=True,  # Was actually fraud
+        analyst_notes="High-risk merchant pattern detected",
+        feedback_timestamp=now
+    )
+    
+    # Steps 2-4 go out in one round trip; the pipeline keeps their order,
+    # so the feedback is only published once both records are stored
+    pipe = redis_client.pipeline(transaction=False)
+    
+    # Step 2: Verify detection engine stores data
+    pipe.setex(transaction_key, 86400, transaction_json)
+    pipe.get(transaction_key)
+    
+    # Step 3: Simulate expert decisions
+    pipe.setex(decisions_key, 86400, _MOCK_DECISIONS_JSON)
+    
+    # Step 4: Test feedback submission
+    pipe.publish('feedback', orjson.dumps(test_feedback.model_dump()))
+    
+    _, stored, _, _ = await pipe.execute()
+    
+    assert stored is not None, "Transaction not stored in Redis"
+    # Replies are decoded to str by the client
+    assert stored == transaction_json.decode(), "Stored transaction does not match"
+    print(f"✅ Step 2: Transaction stored in Redis")
+    print(f"✅ Step 3: Expert decisions stored")
+    print(f"✅ Step 4: Feedback published to Redis")
+    
+    # Step 6 listens on its own connection, so its subscription is set up
+    # while Step 5 waits
+    pubsub = pubsub_client.pubsub()
+    
+    try:
+        # Step 5: Verify feedback can be retrieved, as soon as it is processed
+        metadata, _ = await asyncio.gather(
+            _wait_for_key(redis_client, metadata_key),
+            pubsub.subscribe('kill_switch')
         )
         
         if metadata:
             print(f"✅ Step 5: Feedback metadata stored successfully")
-            metadata_obj = json.loads(metadata)
+            metadata_obj = orjson.loads(metadata)
             print(f"   - Importance weight: {metadata_obj.get('importance_weight', 'N/A')}")
             print(f"   - Delay hours: {metadata_obj.get('delay_hours', 'N/A')}")
         else:
@@ -99,100 +201,122 @@ class IntegrationTest:
         # Step 6: Test kill switch
         print(f"\n✅ Step 6: Testing kill switch mechanism...")
         
-        await redis_client.publish('kill_switch', json.dumps({
+        # Both signals are sent together and confirmed by their delivery,
+        # in order, on the channel rather than by a fixed sleep
+        activate_json = orjson.dumps({
             'active': True,
-            'timestamp': datetime.now().isoformat(),
+            'timestamp': now_iso,
             'activated_by': 'test_suite'
-        }))
-        print(f"   - Kill switch activation signal sent")
-        
-        await asyncio.sleep(0.5)
-        
-        await redis_client.publish('kill_switch', json.dumps({
+        })
+        deactivate_json = orjson.dumps({
             'active': False,
-            'timestamp': datetime.now().isoformat(),
+            'timestamp': now_iso,
             'deactivated_by': 'test_suite'
-        }))
-        print(f"   - Kill switch deactivation signal sent")
-        
-        print("\n" + "="*70)
-        print("✅ ALL INTEGRATION TESTS PASSED")
-        print("="*70 + "\n")
-    
-    async def test_channel_communication(self):
-        """Test all Redis pub/sub channels"""
+        })
         
-        print("\n" + "="*70)
-        print("🧪 INTEGRATION TEST: Channel Communication")
-        print("="*70)
-        
-        channels = [
-            'alerts',
-            'alerts_with_explanations',
-            'feedback',
-            'weight_updates',
-            'kill_switch'
-        ]
+        await asyncio.gather(
+            redis_client.publish('kill_switch', activate_json),
+            redis_client.publish('kill_switch', deactivate_json)
+        )
         
-        for channel in channels:
-            # Test publish
-            test_message = {'test': True, 'channel': channel, 'timestamp': datetime.now().isoformat()}
-            await redis_client.publish(channel, json.dumps(test_message))
-            print(f"✅ Channel '{channel}' - publish successful")
+        signals = (activate_json.decode(), deactivate_json.decode())
+        activation = await _wait_for_message(pubsub, signals)
+        assert activation is not None, "Kill switch activation not delivered"
+        assert activation['data'] == signals[0], "Kill switch signals out of order"
+        print(f"   - Kill switch activation signal sent")
         
-        print("\n" + "="*70)
-        print("✅ ALL CHANNEL TESTS PASSED")
-        print("="*70 + "\n")
+        deactivation = await _wait_for_message(pubsub, signals)
+        assert deactivation is not None, "Kill switch deactivation not delivered"
+        assert deactivation['data'] == signals[1], "Kill switch signals out of order"
+        print(f"   - Kill switch deactivation signal sent")
+    finally:
+        await pubsub.unsubscribe('kill_switch')
+        await pubsub.aclose()
+
+
+@pytest.mark.asyncio
+async def test_channel_communication(redis_client):
+    """Test all Redis pub/sub channels and streams"""
     
-    async def test_data_persistence(self):
-        """Test Redis data persistence"""
-        
-        print("\n" + "="*70)
-        print("🧪 INTEGRATION TEST: Data Persistence")
-        print("="*70)
-        
-        test_keys = [
-            ('transaction:test_001', {'id': 'test_001', 'amount': 100.0}),
-            ('decisions:test_001', {'xgboost': 0.75}),
-            ('alert:test_001', {'alert_id': 'test_001', 'score': 0.8}),
-            ('feedback_metadata:test_001', {'weight': 1.0, 'delay': 2.5})
-        ]
-        
-        # Store data
-        for key, value in test_keys:
-            await redis_client.setex(key, 60, json.dumps(value))
-            print(f"✅ Stored: {key}")
-        
-        # Retrieve data
-        for key, expected_value in test_keys:
-            stored = await redis_client.get(key)
-            assert stored is not None, f"Failed to retrieve {key}"
-            retrieved = json.loads(stored)
-            print(f"✅ Retrieved: {key} - Data matches: {retrieved == expected_value}")
-        
-        # Cleanup
-        for key, _ in test_keys:
-            await redis_client.delete(key)
-        
-        print("\n" + "="*70)
-        print("✅ ALL PERSISTENCE TESTS PASSED")
-        print("="*70 + "\n")
-    
-    async def run_all_tests(self):
-        """Run all integration tests"""
-        print("\n" + "🚀 " * 20)
-        print("STARTING SENTINELFLOW INTEGRATION TESTS")
-        print("🚀 " * 20)
-        
-        await self.test_data_persistence()
-        await self.test_channel_communication()
-        await self.test_complete_workflow()
-        
-        print("\n" + "🎉 " * 20)
-        print("ALL INTEGRATION TESTS COMPLETED SUCCESSFULLY!")
-        print("🎉 " * 20 + "\n")
+    channels = [
+        'alerts_with_explanations',
+        'feedback',
+        'kill_switch'
+    ]
+    # Stream -> field the services read the JSON payload from
+    streams = {
+        ALERTS_STREAM: 'p',
+        WEIGHT_UPDATES_STREAM: 'w'
+    }
+    
+    # Test publish on every channel concurrently
+    timestamp = datetime.now().isoformat()
+    messages = [
+        (channel, orjson.dumps({'test': True, 'channel': channel, 'timestamp': timestamp}))
+        for channel in channels
+    ]
+    await asyncio.gather(*(
+        redis_client.publish(channel, message) for channel, message in messages
+    ))
+    
+    for channel in channels:
+        print(f"✅ Channel '{channel}' - publish successful")
+    
+    # Append to every stream and read each entry back by id
+    payloads = {
+        stream: orjson.dumps({'test': True, 'stream': stream, 'timestamp': timestamp}).decode()
+        for stream in streams
+    }
+    entry_ids = await asyncio.gather(*(
+        redis_client.xadd(stream, {field: payloads[stream]})
+        for stream, field in streams.items()
+    ))
+    try:
+        entries = await asyncio.gather(*(
+            redis_client.xrange(stream, min=entry_id, max=entry_id)
+            for stream, entry_id in zip(streams, entry_ids)
+        ))
+        for (stream, field), entry_id, entry in zip(streams.items(), entry_ids, entries):
+            assert entry == [(entry_id, {field: payloads[stream]})]
+            print(f"✅ Stream '{stream}' - append and read back successful")
+    finally:
+        # Keep test entries out of the services' consumer groups
+        await asyncio.gather(*(
+            redis_client.xdel(stream, entry_id)
+            for stream, entry_id in zip(streams, entry_ids)
+        ))
 
 
-if __name__ == "__main__":
-    test_suite = IntegrationTest()
-    asyncio.run(test_suite.run_all_tests())
\ No newline at end of file
+@pytest.mark.asyncio
+async def test_data_persistence(redis_client):
+    """Test Redis data persistence"""
+    
+    test_keys = [
+        ('transaction:test_001', {'id': 'test_001', 'amount': 100.0}),
+        ('decisions:test_001', {'xgboost': 0.75}),
+        ('alert:test_001', {'alert_id': 'test_001', 'score': 0.8}),
+        ('feedback_metadata:test_001', {'weight': 1.0, 'delay': 2.5})
+    ]
+    # Serialized once; the read side compares the stored strings directly
+    serialized = [(key, orjson.dumps(value)) for key, value in test_keys]
+    keys = [key for key, _ in serialized]
+    
+    # Store data, one script call for all keys
+    await _setex_many(
+        keys=keys,
+        args=[60] + [payload for _, payload in serialized],
+        client=redis_client
+    )
+    for key in keys:
+        print(f"✅ Stored: {key}")
+    
+    # Retrieve data
+    stored_values = await redis_client.mget(keys)
+    
+    for (key, payload), stored in zip(serialized, stored_values):
+        assert stored is not None, f"Failed to retrieve {key}"
+        assert stored == payload.decode(), f"Data mismatch for {key}"
+        print(f"✅ Retrieved: {key}")
+    
+    # Cleanup; UNLINK frees the values off the server's main thread
+    await redis_client.unlink(*keys)
@@ -0,0 +1,43 @@
+# tests/test_half_space_trees.py
+"""
+Unit tests for the Half-Space Trees expert
+
+Run with `python -m pytest tests/test_half_space_trees.py`
+"""
+import numpy as np
+from detection_engine.experts.half_space_trees import HalfSpaceTreesExpert
+
+N_FEATURES = 30
+BATCH_SIZE = 64
+
+
+def _score(expert, X):
+    return [d.score for d in expert.predict_batch([None] * len(X), X)]
+
+
+def test_outlier_scores_above_normal_points():
+    rng = np.random.default_rng(1)
+    X = rng.lognormal(size=(3000, N_FEATURES)).astype(np.float32)
+    expert = HalfSpaceTreesExpert(seed=1)
+    
+    scores = []
+    for start in range(0, len(X), BATCH_SIZE):
+        scores.extend(_score(expert, X[start:start + BATCH_SIZE]))
+    
+    # Points after the first window are scored against a reference window
+    normal = np.array(scores[expert.window_size:])
+    outlier = _score(expert, np.full((1, N_FEATURES), 50, dtype=np.float32))[0]
+    
+    assert outlier > normal.max()
+    assert outlier - np.median(normal) > 0.5
+
+
+def test_scores_stay_in_unit_interval():
+    rng = np.random.default_rng(1)
+    expert = HalfSpaceTreesExpert(window_size=100, n_trees=5, height=6, seed=1)
+    
+    # Placeholder score until the first window is full
+    assert _score(expert, rng.lognormal(size=(100, N_FEATURES)).astype(np.float32)) == [0.1] * 100
+    
+    scores = _score(expert, rng.lognormal(size=(250, N_FEATURES)).astype(np.float32))
+    assert all(0.0 <= score <= 1.0 for score in scores)